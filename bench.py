@@ -0,0 +1,455 @@
+#======================================================================
+# i3 (Python module for communicating with i3 window manager)
+# Copyright (C) 2012  Jure Ziberna
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#======================================================================
+"""
+Micro-benchmarks for i3.py. Run all of them with "python bench.py" or pick
+some by name, e.g. "python bench.py send". None of them needs a running
+i3-wm, sockets are served by a local stand-in that drains or echoes frames.
+Trees recorded from a real session can be used by the codec benchmark, see
+"recorded_trees".
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import tempfile
+import threading
+import timeit
+
+import i3
+
+
+BENCHMARKS = []
+
+def benchmark(function):
+    """
+    Registers a benchmark function.
+    """
+    BENCHMARKS.append(function)
+    return function
+
+
+def report(name, *timings):
+    """
+    Prints a line of (label, seconds) timings.
+    """
+    columns = ['%s: %9.2f us' % (label, seconds * 1e6) for label, seconds in timings]
+    print('%-24s %s' % (name, '  '.join(columns)))
+
+
+def measure(function, number=None):
+    """
+    Returns the best time of a single call of the given function.
+    """
+    timer = timeit.Timer(function)
+    if not number:
+        number, _ = timer.autorange() if hasattr(timer, 'autorange') else (100, 0)
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+class Server(threading.Thread):
+    """
+    A stand-in for i3-wm listening on a temporary socket. Reads and drops
+    everything it receives.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ipc.sock')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(8)
+        self.start()
+
+    def run(self):
+        while True:
+            conn, _ = self.server.accept()
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, conn):
+        data = bytearray(1 << 20)
+        while conn.recv_into(data):
+            pass
+
+
+class ReplyServer(Server):
+    """
+    A stand-in that replies to every frame with the same payload, an empty
+    list by default.
+    """
+    header = struct.Struct('<6sII')
+    payload = b'[]'
+    
+    def serve(self, conn):
+        data = b''
+        reply = self.header.pack(b'i3-ipc', len(self.payload), 5) + self.payload
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+            replies = 0
+            while len(data) >= self.header.size:
+                length = self.header.unpack(data[:self.header.size])[1]
+                if len(data) < self.header.size + length:
+                    break
+                data = data[self.header.size + length:]
+                replies += 1
+            conn.sendall(reply * replies)
+
+
+def old_pack(msg_type, payload):
+    """
+    The pack method before it became binary-safe, kept for comparison.
+    """
+    msg_length = len(payload.encode('utf-8'))
+    msg_type = i3.parse_msg_type(msg_type)
+    msg_length = struct.pack('I', msg_length).decode('utf-8')
+    msg_type = struct.pack('I', msg_type).decode('utf-8')
+    message = '%s%s%s%s' % ('i3-ipc', msg_length, msg_type, payload)
+    return message.encode('utf-8')
+
+
+@benchmark
+def send():
+    """
+    Old concatenating send path against the current one, which joins small
+    messages and sends large payloads without copying them.
+    """
+    server = Server()
+    sock = i3.Socket(server.path, timeout=5)
+    for label, size in [('10 B', 10), ('10 KB', 10 * 1024), ('1 MB', 1024 * 1024)]:
+        payload = 'x' * size
+        old = measure(lambda: sock.socket.sendall(old_pack(0, payload)))
+        new = measure(lambda: sock.send(0, payload))
+        data = payload.encode('utf-8')
+        new_bytes = measure(lambda: sock.send(0, data))
+        report('send %s' % label, ('old', old), ('new', new), ('new bytes', new_bytes))
+    sock.close()
+
+
+def synthetic_tree(count, outputs=2, workspaces=10):
+    """
+    Returns a get_tree-like tree with about count containers, split over
+    outputs and workspaces, with nested splits, floating windows and marks.
+    """
+    ids = iter(range(1, count * 2))
+    def node(type, name, nodes=None, floating=None, **extra):
+        con_id = next(ids)
+        result = {
+            'id': con_id, 'type': type, 'name': name, 'focused': False,
+            'urgent': False, 'layout': 'splith', 'orientation': 'horizontal',
+            'border': 'normal', 'marks': [], 'window': None,
+            'rect': {'x': 0, 'y': 0, 'width': 1920, 'height': 1080},
+            'window_rect': {'x': 0, 'y': 0, 'width': 0, 'height': 0},
+            'deco_rect': {'x': 0, 'y': 0, 'width': 0, 'height': 0},
+            'nodes': nodes or [], 'floating_nodes': floating or [],
+        }
+        result.update(extra)
+        return result
+    def window(index):
+        con = node('con', 'window %d' % index)
+        con['window'] = 0x1000000 + con['id']
+        con['window_properties'] = {'class': 'URxvt', 'instance': 'urxvt'}
+        if index % 50 == 0:
+            con['marks'] = ['mark%d' % index]
+        return con
+    per_workspace = max(count // (outputs * workspaces), 4)
+    index = 0
+    output_nodes = []
+    for output in range(outputs):
+        workspace_nodes = []
+        for workspace in range(workspaces):
+            splits = []
+            for split in range(0, per_workspace - 1, 4):
+                windows = [window(index + offset) for offset in range(3)]
+                index += 3
+                splits.append(node('con', None, windows))
+            floating = [node('floating_con', None, [window(index)])]
+            index += 1
+            number = output * workspaces + workspace + 1
+            workspace_nodes.append(node('workspace', str(number), splits,
+                                        floating, num=number))
+        content = node('con', 'content', workspace_nodes)
+        output_nodes.append(node('output', 'OUT-%d' % output, [content]))
+    output_nodes[0]['nodes'][0]['nodes'][0]['nodes'][0]['nodes'][0]['focused'] = True
+    return node('root', 'root', output_nodes)
+
+
+def old_parent(con_id, tree):
+    """
+    The parent function before i3.Tree, kept for comparison.
+    """
+    def has_child(node):
+        for child in node['nodes']:
+            if child['id'] == con_id:
+                return True
+        return False
+    parents = old_filter(tree, has_child)
+    if not parents or len(parents) > 1:
+        return None
+    return parents[0]
+
+
+def old_filter(tree=None, function=None, **conditions):
+    """
+    The recursive filter function, kept for comparison.
+    """
+    if isinstance(tree, list):
+        tree = {'list': tree}
+    if function:
+        try:
+            if function(tree):
+                return [tree]
+        except (KeyError, IndexError):
+            pass
+    else:
+        for key, value in conditions.items():
+            if key not in tree or tree[key] != value:
+                break
+        else:
+            return [tree]
+    matches = []
+    for nodes in ['nodes', 'floating_nodes', 'list']:
+        if nodes in tree:
+            for node in tree[nodes]:
+                matches += old_filter(node, function, **conditions)
+    return matches
+
+
+@benchmark
+def tree():
+    """
+    Parent lookup by scanning the tree against i3.Tree, on trees of
+    different sizes.
+    """
+    for count in [500, 5000]:
+        data = synthetic_tree(count)
+        index = i3.Tree(data)
+        leaf = max(index.nodes)
+        build = measure(lambda: i3.Tree(data))
+        scan = measure(lambda: old_parent(leaf, data))
+        lookup = measure(lambda: index.parent(leaf))
+        upward = measure(lambda: index.workspace_of(leaf))
+        report('tree %d containers' % len(index), ('scan parent', scan),
+               ('build', build), ('parent', lookup), ('workspace_of', upward))
+
+
+@benchmark
+def filter():
+    """
+    The recursive filter against the compiled query.
+    """
+    data = synthetic_tree(5000)
+    query = i3.Query(nodes=[], focused=True)
+    for label, conditions in [('leaves', {'nodes': []}),
+                              ('focused leaf', {'nodes': [], 'focused': True})]:
+        old = measure(lambda: old_filter(data, **conditions))
+        new = measure(lambda: i3.filter(data, **conditions))
+        report('filter %s' % label, ('recursive', old), ('query', new))
+    first = measure(lambda: query.first(data))
+    report('filter first focused', ('query.first', first))
+
+
+def in_threads(function, threads, calls):
+    """
+    Returns the time it takes the given number of threads to call function
+    calls times each.
+    """
+    def work():
+        for call in range(calls):
+            function()
+    workers = [threading.Thread(target=work) for thread in range(threads)]
+    start = timeit.default_timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return timeit.default_timer() - start
+
+
+@benchmark
+def shared():
+    """
+    Requests from several threads: one socket behind a lock, a socket pool
+    and a multiplexed socket. Per request times.
+    """
+    server = ReplyServer()
+    locked = i3.Socket(server.path, timeout=5)
+    lock = threading.Lock()
+    def locked_get():
+        with lock:
+            locked.get('get_marks')
+    pool = i3.SocketPool(4, server.path, timeout=5)
+    multiplexed = i3.MultiplexedSocket(server.path, timeout=5)
+    calls = 500
+    for threads in [1, 4, 16]:
+        count = threads * calls
+        timings = [('lock', in_threads(locked_get, threads, calls) / count),
+                   ('pool', in_threads(lambda: pool.get('get_marks'), threads, calls) / count),
+                   ('multiplexed', in_threads(lambda: multiplexed.get('get_marks'),
+                                              threads, calls) / count)]
+        report('shared %d threads' % threads, *timings)
+    locked.close()
+    pool.close()
+    multiplexed.close()
+
+
+@benchmark
+def snapshot():
+    """
+    Getting a tree from a snapshot file against decoding the JSON reply,
+    and finding the focused window in it.
+    """
+    directory = tempfile.mkdtemp()
+    for count in [500, 5000]:
+        data = synthetic_tree(count)
+        text = json.dumps(data)
+        server = ReplyServer()
+        server.payload = text.encode('utf-8')
+        path = os.path.join(directory, 'tree-%d' % count)
+        publisher = i3.SnapshotPublisher(path, i3.Socket(server.path, timeout=5),
+                                         i3.Socket(server.path, timeout=5))
+        while publisher.published == 0:
+            time.sleep(0.01)
+        reader = i3.SnapshotReader(path)
+        query = i3.Query(nodes=[], focused=True)
+        decode = measure(lambda: json.loads(text))
+        read = measure(lambda: reader.read().root)
+        decode_find = measure(lambda: query.first(json.loads(text)))
+        read_find = measure(lambda: query.first(reader.read().root))
+        publish = measure(lambda: publisher.publish(data))
+        report('snapshot %d containers' % count, ('json', decode), ('read', read),
+               ('json+find', decode_find), ('read+find', read_find),
+               ('publish', publish))
+        reader.close()
+        publisher.close()
+
+
+def recorded_trees():
+    """
+    Returns (label, payload) pairs of the trees recorded in the directory
+    given by the I3PY_TREES environment variable (e.g. with "i3-msg -t
+    get_tree > tree.json"), or synthetic trees if it isn't set.
+    """
+    directory = os.environ.get('I3PY_TREES')
+    if not directory:
+        return [('%d containers' % count, json.dumps(synthetic_tree(count)).encode('utf-8'))
+                for count in [500, 5000]]
+    trees = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as tree_file:
+            trees.append((name, tree_file.read()))
+    return trees
+
+
+@benchmark
+def codec():
+    """
+    Decoding get_tree replies with each installed JSON codec.
+    """
+    for label, payload in recorded_trees():
+        timings = [(name, measure(lambda: codec.loads(payload)))
+                   for name, codec in i3.CODECS.items()]
+        report('codec %s' % label, *timings)
+
+
+def peak_memory(function):
+    """
+    Returns the peak memory allocated by a call of the given function, in
+    bytes (0 before Python 3.4, which has no tracemalloc).
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return 0
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def stream():
+    """
+    Decoding whole get_tree replies against selecting parts of them: only
+    a few fields, without the second output, and stopping at the focused
+    window. Times, then peak memory in MB.
+    """
+    fields = ['id', 'name', 'window', 'focused']
+    prune = lambda node: node.get('name') == 'OUT-1'
+    for label, payload in recorded_trees():
+        cases = [
+            ('json', lambda: json.loads(payload.decode('utf-8'))),
+            ('parse', lambda: i3.parse_tree(payload)),
+            ('fields', lambda: i3.parse_tree(payload, fields)),
+            ('pruned', lambda: i3.parse_tree(payload, fields, prune)),
+            ('first', lambda: next(node for node in i3.iter_tree(payload, fields)
+                                   if node['focused'])),
+        ]
+        report('stream %s' % label, *[(name, measure(case)) for name, case in cases])
+        print('%-24s %s' % ('', '  '.join('%s: %9.2f MB' % (name, peak_memory(case) / 1e6)
+                                         for name, case in cases)))
+
+
+def retained_memory(function, count):
+    """
+    Returns the memory held by the results of count calls of the given
+    function, per call, in bytes (0 before Python 3.4).
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return 0
+    tracemalloc.start()
+    try:
+        results = [function() for call in range(count)]
+        return tracemalloc.get_traced_memory()[0] / float(count)
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def nodes():
+    """
+    Memory held by decoded trees as dicts and as i3.Node objects, in MB per
+    tree out of several kept at once, and the time it takes to convert one.
+    """
+    for label, payload in recorded_trees():
+        text = payload.decode('utf-8')
+        tree = json.loads(text)
+        as_dicts = retained_memory(lambda: json.loads(text), 5)
+        as_nodes = retained_memory(lambda: i3.Node(json.loads(text)), 5)
+        print('%-24s dicts: %9.2f MB  nodes: %9.2f MB' % ('nodes %s' % label,
+                                                         as_dicts / 1e6, as_nodes / 1e6))
+        report('', ('convert', measure(lambda: i3.Node(tree))),
+               ('to_dict', measure(i3.Node(tree).to_dict)))
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for function in BENCHMARKS:
+        if not names or function.__name__ in names:
+            function()
@@ -10,9 +10,10 @@ def cycle():
     for window in other:
         i3.focus(con_id=window['id'])
         time.sleep(0.5)
-    # focus the original windows
-    for window in current:
-        i3.focus(con_id=window['id'])
+    # focus the original windows (all at once)
+    with i3.batch() as batch:
+        for window in current:
+            batch.focus(con_id=window['id'])
 
 if __name__ == '__main__':
     cycle()
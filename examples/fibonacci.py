@@ -6,9 +6,11 @@ term = os.environ.get('TERM', 'xterm')
 if 'rxvt-unicode' in term: 
     term = 'urxvt'
 
+def closed(event):
+    return event['change'] == 'close'
+
 def fibonacci(num):
-    i3.exec(term)
-    time.sleep(0.5)
+    i3.exec_and_wait(term)
     if num % 2 == 0:
         if num % 4 == 0:
             i3.focus('up')
@@ -30,8 +32,7 @@ def run(num):
     time.sleep(3)
     # close all opened terminals
     for n in range(num):
-        i3.kill()
-        time.sleep(0.5)
+        i3.wait_for('window', closed, timeout=2, action=i3.kill)
     i3.workspace(current['name'])
 
 if __name__ == '__main__':
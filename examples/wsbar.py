@@ -98,25 +98,18 @@ class i3wsbar(object):
         # Initialize bar application...
         args = [self.bar_command] + self.bar_arguments
         self.bar = subprocess.Popen(args, stdin=subprocess.PIPE)
-        # ...and socket
-        self.socket = i3.Socket()
+        # ...and workspace state, kept up to date by events
+        self.state = i3.WorkspaceState(callback=self.change)
         # Output to the bar right away
-        workspaces = self.socket.get('get_workspaces')
-        outputs = self.socket.get('get_outputs')
-        self.display(self.format(workspaces, outputs))
-        # Subscribe to an event
-        callback = lambda data, event, _: self.change(data, event)
-        self.subscription = i3.Subscription(callback, 'workspace')
+        self.change(self.state)
     
-    def change(self, event, workspaces):
+    def change(self, state):
         """
-        Receives event and workspace data, changes the bar if change is
-        present in event.
+        Receives the workspace state and changes the bar.
         """
-        if 'change' in event:
-            outputs = self.socket.get('get_outputs')
-            bar_text = self.format(workspaces, outputs)
-            self.display(bar_text)
+        workspaces, outputs = state.snapshot
+        bar_text = self.format(workspaces, outputs)
+        self.display(bar_text)
     
     def format(self, workspaces, outputs):
         """
@@ -152,10 +145,10 @@ class i3wsbar(object):
     
     def quit(self):
         """
-        Quits the i3wsbar; closes the subscription and terminates the bar
+        Quits the i3wsbar; closes the workspace state and terminates the bar
         application.
         """
-        self.subscription.close()
+        self.state.close()
         self.bar.terminate()
 
 
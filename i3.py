@@ -17,12 +17,25 @@
 #======================================================================
 
 
+import os
+import re
 import sys
+import errno
+import stat
+import codecs
 import subprocess
 import json
 import socket
+import select
+import mmap
 import struct
 import threading
+import itertools
+import collections
+import traceback
+import contextlib
+import importlib
+import argparse
 import time
 
 ModuleType = type(sys)
@@ -42,13 +55,29 @@ MSG_TYPES = [
     'get_tree',
     'get_marks',
     'get_bar_config',
+    'get_version',
+    'get_binding_modes',
+    'get_config',
+    'send_tick',
+    'sync',
+    'get_binding_state',
 ]
 
 EVENT_TYPES = [
     'workspace',
     'output',
+    'mode',
+    'window',
+    'barconfig_update',
+    'binding',
+    'shutdown',
+    'tick',
 ]
 
+EVENT_FLAG = 1 << 31  # set in the message type of events
+
+TEXT_TYPES = (str, type(u''))  # str and unicode on Python 2
+
 
 class i3Exception(Exception):
     pass
@@ -119,6 +148,163 @@ def parse_event_type(event_type):
     else:
         raise EventTypeError(event_type)
 
+def event_type_of(msg_type):
+    """
+    Returns the event type of the given (received) message type, or None if
+    it's a reply. Events have i3.EVENT_FLAG set in their message type.
+    """
+    if not msg_type & EVENT_FLAG:
+        return None
+    index = msg_type & ~EVENT_FLAG
+    if index < len(EVENT_TYPES):
+        return EVENT_TYPES[index]
+    return str(index)  # an event type newer than this module
+
+
+class Codec(object):
+    """
+    JSON backend of sockets. Decodes replies and events straight from the
+    received bytes and encodes payloads.
+    Arguments:
+    - name of the codec
+    - loads, takes a byte string or memoryview and returns the decoded value
+    - dumps, takes a value and returns it as a string or byte string
+    Codecs of the installed JSON libraries are in "i3.CODECS", see
+    "i3.default_codec" and the codec argument of i3.Socket.
+    """
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+    
+    def __repr__(self):
+        return '<i3.Codec %s>' % self.name
+
+
+def __load_codecs__():
+    """
+    Returns an ordered dict of codecs by name, fastest first: orjson, ujson
+    and simplejson if installed, and json of the standard library.
+    """
+    utf_8_decode = codecs.utf_8_decode
+    available = collections.OrderedDict()
+    try:
+        import orjson  # takes bytes as they are
+        available['orjson'] = Codec('orjson', orjson.loads, orjson.dumps)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        available['ujson'] = Codec('ujson', lambda data: ujson.loads(utf_8_decode(data)[0]),
+                                   ujson.dumps)
+    except ImportError:
+        pass
+    try:
+        import simplejson
+        available['simplejson'] = Codec(
+            'simplejson', lambda data: simplejson.loads(utf_8_decode(data)[0]),
+            simplejson.dumps)
+    except ImportError:
+        pass
+    available['json'] = Codec('json', lambda data: json.loads(utf_8_decode(data)[0]),
+                              json.dumps)
+    return available
+
+CODECS = __load_codecs__()
+
+
+class FrameBuffer(object):
+    """
+    Receive buffer for i3-ipc frames. Bytes are read straight into a
+    preallocated bytearray (see "FrameBuffer.reserve") and complete frames
+    are handed out as memoryview slices of it, so nothing is copied between
+    the socket and the JSON decoder. Any number of frames can be buffered,
+    and a frame can be split across any number of reads.
+    Arguments:
+    - header as a struct.Struct object of the i3-ipc header
+    - size of the initial buffer in bytes
+    """
+    size = 4096  # initial buffer size in bytes
+    
+    def __init__(self, header, size=None):
+        self.header = header
+        self.data = bytearray(size or self.size)
+        self.start = 0  # offset of the first unread byte
+        self.end = 0  # offset right after the last received byte
+    
+    def __len__(self):
+        """
+        Returns the number of buffered bytes.
+        """
+        return self.end - self.start
+    
+    def missing(self):
+        """
+        Returns the number of bytes still needed to complete the next frame
+        (or its header, if even that isn't complete yet).
+        """
+        available = self.end - self.start
+        if available < self.header.size:
+            return self.header.size - available
+        msg_length = self.header.unpack_from(self.data, self.start)[1]
+        return max(self.header.size + msg_length - available, 0)
+    
+    def reserve(self, size):
+        """
+        Makes room for at least size bytes and returns a writable
+        memoryview of the free space. Already consumed bytes are dropped
+        first, the buffer only grows if that isn't enough.
+        """
+        if len(self.data) - self.end < size:
+            used = self.end - self.start
+            capacity = len(self.data)
+            if used + size > capacity:
+                while capacity < used + size:
+                    capacity *= 2
+                data = bytearray(capacity)
+            else:
+                data = self.data
+            data[:used] = self.data[self.start:self.end]
+            self.data = data
+            self.start = 0
+            self.end = used
+        return memoryview(self.data)[self.end:]
+    
+    def commit(self, size):
+        """
+        Marks size bytes of the reserved space as received.
+        """
+        self.end += size
+    
+    def feed(self, data):
+        """
+        Copies the given byte string into the buffer.
+        """
+        size = len(data)
+        self.reserve(size)[:size] = data
+        self.commit(size)
+    
+    def next_frame(self):
+        """
+        Returns a (msg_type, payload) tuple of the next complete frame or
+        None if there isn't one. The payload is a memoryview of the buffer
+        and is only valid until the buffer is written to again.
+        """
+        available = self.end - self.start
+        if available < self.header.size:
+            return None
+        msg_magic, msg_length, msg_type = self.header.unpack_from(self.data,
+                                                                  self.start)
+        msg_size = self.header.size + msg_length
+        if available < msg_size:
+            return None
+        payload_start = self.start + self.header.size
+        payload = memoryview(self.data)[payload_start:self.start + msg_size]
+        self.start += msg_size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return msg_type, payload
+
 
 class Socket(object):
     """
@@ -129,15 +315,40 @@ class Socket(object):
     - timeout in seconds
     - chunk_size in bytes
     - magic_string as a safety string for i3-ipc. Set to 'i3-ipc' by default.
+    - lazy, if True the socket connects on first use instead of right away
+    - reconnect, if True a dropped connection (e.g. after i3-wm restarts) is
+      reconnected on next use, retrying with an exponential backoff
+    - blocking, if False the socket never blocks, for use with external
+      event loops (see "socket.fileno", "socket.read_available" and
+      "socket.flush")
+    - codec for JSON, an i3.Codec or the name of one in "i3.CODECS".
+      "i3.default_codec()" if not given.
+    The connection state is kept in "socket.state" and follows socket errors
+    and EOF. It is one of the following:
+    - 'idle', not connected yet (lazy sockets)
+    - 'connected'
+    - 'disconnected', dropped on error or when i3-wm closed the connection
+    - 'closed', closed via "socket.close()"
     """
     magic_string = 'i3-ipc'  # safety string for i3-ipc
     chunk_size = 1024  # in bytes
     timeout = 0.5  # in seconds
-    buffer = b''  # byte string
+    iov_max = 1024  # most buffers a single sendmsg call takes
+    join_size = 16 * 1024  # in bytes, smaller messages are sent as one buffer
+    reconnect = False
+    reconnect_attempts = 8
+    reconnect_delay = 0.05  # in seconds, doubled on each failed attempt
+    reconnect_max_delay = 2  # in seconds
+    blocking = True
+    blocking_errors = (errno.EAGAIN, errno.EWOULDBLOCK)
+    state = 'idle'
+    socket = None
     
     def __init__(self, path=None, timeout=None, chunk_size=None,
-                 magic_string=None):
-        if not path:
+                 magic_string=None, lazy=False, reconnect=None, blocking=None,
+                 codec=None):
+        self.resolved = not path  # path is looked up, see get_socket_path
+        if not path and not lazy:
             path = get_socket_path()
         self.path = path
         if timeout:
@@ -146,12 +357,22 @@ class Socket(object):
             self.chunk_size = chunk_size
         if magic_string:
             self.magic_string = magic_string
-        # Socket initialization and connection
-        self.initialize()
-        self.connect()
+        if reconnect is not None:
+            self.reconnect = reconnect
+        if blocking is not None:
+            self.blocking = blocking
+        self.codec = get_codec(codec)
+        self.outgoing = []  # buffers not written yet, non-blocking sockets
+        self.queued_events = collections.deque()  # received while awaiting a reply
         # Struct format initialization, length of magic string is in bytes
-        self.struct_header = '<%dsII' % len(self.magic_string.encode('utf-8'))
-        self.struct_header_size = struct.calcsize(self.struct_header)
+        self.magic = self.magic_string.encode('utf-8')
+        self.struct_header = '<%dsII' % len(self.magic)
+        self.header = struct.Struct(self.struct_header)
+        self.struct_header_size = self.header.size
+        self.buffer = FrameBuffer(self.header)
+        # Socket connection, unless deferred until first use
+        if not lazy:
+            self.connect()
     
     def initialize(self):
         """
@@ -159,27 +380,96 @@ class Socket(object):
         """
         self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.socket.settimeout(self.timeout)
+        self.buffer = FrameBuffer(self.header)
     
     def connect(self, path=None):
         """
         Connects the socket to socket path if not already connected.
+        Doesn't send anything to i3-wm.
         """
-        if not self.connected:
-            self.initialize()
-            if not path:
-                path = self.path
-            try:
-                self.socket.connect(path)
-            except socket.error:
-                raise ConnectionError(path)
+        global __socket_path__
+        if self.state == 'connected':
+            return
+        if path:
+            self.path = path
+            self.resolved = False
+        elif not self.path:
+            self.path = get_socket_path()
+        self.initialize()
+        try:
+            self.socket.connect(self.path)
+        except socket.error:
+            self.socket.close()
+            if self.state != 'idle':  # idle sockets try again on next use
+                self.state = 'disconnected'
+            path = self.path
+            if self.resolved:
+                # The path may be stale (e.g. a new i3-wm session), so look
+                # it up again next time
+                self.path = None
+                if __socket_path__ == path:
+                    __socket_path__ = None
+            raise ConnectionError(path)
+        if not self.blocking:
+            self.socket.setblocking(False)
+        self.state = 'connected'
+    
+    def attach(self, connection):
+        """
+        Uses the given connected socket object, e.g. one accepted by a
+        server speaking i3-ipc framing.
+        """
+        self.socket = connection
+        self.socket.settimeout(self.timeout)
+        self.buffer = FrameBuffer(self.header)
+        self.state = 'connected'
+    
+    def ensure_connected(self):
+        """
+        Connects a lazy socket on first use and reconnects a dropped one if
+        reconnecting is enabled. Raises socket.error if the socket was
+        closed or dropped otherwise.
+        """
+        if self.state == 'connected':
+            return
+        if self.state == 'idle':
+            self.connect()
+        elif self.state == 'disconnected' and self.reconnect:
+            delay = self.reconnect_delay
+            for attempt in range(self.reconnect_attempts - 1):
+                try:
+                    return self.connect()
+                except ConnectionError:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.reconnect_max_delay)
+            self.connect()
+        else:
+            raise socket.error(errno.ENOTCONN, 'Socket is %s' % self.state)
+    
+    def drop(self):
+        """
+        Marks the connection as dropped and closes the underlying socket.
+        Called on socket errors and EOF.
+        """
+        self.state = 'disconnected'
+        self.outgoing = []  # a partially written frame can't be resumed
+        self.socket.close()
     
     def get(self, msg_type, payload=''):
         """
         Convenience method, calls "socket.send(msg_type, payload)" and
-        returns data from "socket.receive()".
+        returns data from "socket.receive_reply()".
         """
         self.send(msg_type, payload)
-        return self.receive()
+        return self.receive_reply()
+    
+    def get_raw(self, msg_type, payload=''):
+        """
+        Same as "socket.get", but returns the reply as a byte string,
+        without decoding it (e.g. for "i3.iter_tree").
+        """
+        self.send(msg_type, payload)
+        return self.receive_reply(raw=True)
     
     def subscribe(self, event_type, event=None):
         """
@@ -190,91 +480,713 @@ class Socket(object):
         payload = [event_type]
         if event:
             payload.append(event)
-        payload = json.dumps(payload)
+        payload = self.codec.dumps(payload)
         return self.get('subscribe', payload)
     
+    def get_many(self, requests):
+        """
+        Pipelined version of "socket.get". Takes a list of (msg_type, payload)
+        tuples (or just message types), sends all of them at once and then
+        returns the replies in the same order. Once a reply times out, it and
+        the remaining ones are None and the connection is dropped.
+        """
+        buffers = []
+        for request in requests:
+            if isinstance(request, (tuple, list)):
+                buffers += self.frame(*request)
+            else:
+                buffers += self.frame(request)
+        self.write(*buffers)
+        count = len(buffers) // 2
+        replies = []
+        while len(replies) < count:
+            reply = self.receive_reply()
+            if reply is None:
+                # A late reply would be taken for the next request
+                self.drop()
+                replies += [None] * (count - len(replies))
+                break
+            replies.append(reply)
+        return replies
+    
     def send(self, msg_type, payload=''):
         """
-        Sends the given message type with given message by packing them
-        and continuously sending bytes from the packed message.
+        Sends the given message type with given payload. The payload can be
+        a string, a byte string or a memoryview. Header and payload of small
+        messages are joined, larger payloads are sent without being copied.
+        """
+        self.write(*self.frame(msg_type, payload))
+    
+    def frame(self, msg_type, payload=''):
+        """
+        Returns a (header, payload) tuple of byte buffers for the given
+        message type and payload.
+        """
+        payload = self.encode(payload)
+        header = self.header.pack(self.magic, len(payload),
+                                  parse_msg_type(msg_type))
+        return header, payload
+    
+    def write(self, *buffers):
+        """
+        Writes all of the given byte buffers to the socket. Buffers smaller
+        than join_size in total are joined and sent at once, larger ones with
+        scatter/gather "sendmsg" calls where available, continuing after
+        partial writes. Non-blocking sockets queue the buffers and write as
+        much as they can right away, see "socket.flush".
+        """
+        if not self.blocking:
+            self.outgoing.extend(buffers)
+            self.flush()
+            return
+        self.ensure_connected()
+        try:
+            if sum(len(buffer) for buffer in buffers) < self.join_size:
+                self.socket.sendall(b''.join(buffers))
+            elif hasattr(self.socket, 'sendmsg'):
+                self.write_vectored(list(buffers))
+            else:
+                for data in buffers:
+                    self.socket.sendall(data)
+        except socket.error:
+            # Including timeouts, the peer may have a partial frame
+            self.drop()
+            raise
+    
+    def write_vectored(self, buffers):
+        """
+        Writes the list of buffers with "sendmsg", at most iov_max buffers
+        per call.
+        """
+        while buffers:
+            if hasattr(self.socket, 'sendmsg'):
+                sent = self.socket.sendmsg(buffers[:self.iov_max])
+            else:
+                sent = self.socket.send(buffers[0])
+            # Drop what was sent, the first remaining buffer may be partial
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            if sent:
+                buffers[0] = memoryview(buffers[0])[sent:]
+    
+    def flush(self):
+        """
+        Writes as much of the queued data of a non-blocking socket as the
+        socket takes without blocking. Returns True if nothing is left, call
+        again once the socket is writable otherwise.
+        """
+        if not self.outgoing:
+            return True
+        self.ensure_connected()
+        try:
+            self.write_vectored(self.outgoing)
+        except socket.error as error:
+            if error.errno not in self.blocking_errors:
+                self.drop()
+                raise
+        return not self.outgoing
+    
+    @property
+    def pending_writes(self):
+        """
+        Number of queued bytes a non-blocking socket hasn't written yet.
+        """
+        return sum(len(buffer) for buffer in self.outgoing)
+    
+    def fileno(self):
+        """
+        Returns the file descriptor of the socket (connecting a lazy socket
+        first), for registering with select, poll or an event loop.
+        """
+        self.ensure_connected()
+        return self.socket.fileno()
+    
+    def read_available(self):
+        """
+        Reads whatever the socket has without blocking and returns a list
+        of (msg_type, data) tuples of all complete messages, possibly empty.
+        Meant for non-blocking sockets, when the socket is readable.
+        Raises socket.error when i3 closes the connection, unless some
+        messages were read before that.
+        """
+        messages = []
+        while True:
+            try:
+                self.fill()
+            except socket.error as error:
+                if error.errno in self.blocking_errors:
+                    break
+                if messages:
+                    break  # the error is raised again on next use
+                raise
+            messages += self.feed()
+        return messages
+    
+    def feed(self, data=b''):
+        """
+        Adds the given byte string, e.g. read by an event loop, to the
+        receive buffer. Returns a list of (msg_type, data) tuples of all
+        complete messages in the buffer.
         """
-        message = self.pack(msg_type, payload)
-        # Continuously send the bytes from the message
-        self.socket.sendall(message)
+        if data:
+            self.buffer.feed(data)
+        messages = []
+        frame = self.buffer.next_frame()
+        while frame is not None:
+            msg_type, payload = frame
+            messages.append((msg_type, self.decode(payload)))
+            frame = self.buffer.next_frame()
+        return messages
     
     def receive(self):
         """
-        Tries to receive a data. Unpacks the received byte string if
-        successful. Returns None on failure.
+        Tries to receive a message. Returns the next buffered message if
+        there is one, otherwise reads from the socket until a whole message
+        gets through. Returns None on timeout; a partially received message
+        stays buffered for the next call.
+        """
+        message = self.receive_message()
+        if message is None:
+            return None
+        return message[1]
+    
+    def receive_reply(self, raw=False):
+        """
+        Same as "socket.receive", but skips events, so that a subscribed
+        socket can be used for requests as well. Skipped events are queued
+        and returned by "socket.receive" and the like later on. With raw,
+        the reply is returned as a byte string.
+        """
+        while True:
+            message = self.read_message(raw)
+            if message is None:
+                return None
+            msg_type, data = message
+            if not msg_type & EVENT_FLAG:
+                return data
+            self.queued_events.append(message)
+    
+    def receive_message(self):
+        """
+        Same as "socket.receive", but returns a (msg_type, data) tuple. For
+        events, msg_type has i3.EVENT_FLAG set (see i3.event_type_of).
+        Non-blocking sockets return None right away when there's no whole
+        message to read.
+        """
+        if self.queued_events:
+            return self.queued_events.popleft()
+        return self.read_message()
+    
+    def read_message(self, raw=False):
+        """
+        Reads the next (msg_type, data) message from the receive buffer or
+        the socket, see "socket.receive_message". With raw, replies are
+        returned as byte strings (events are decoded either way).
         """
         try:
-            data = self.socket.recv(self.chunk_size)
-            msg_magic, msg_length, msg_type = self.unpack_header(data)
-            msg_size = self.struct_header_size + msg_length
-            # Keep receiving data until the whole message gets through
-            while len(data) < msg_size:
-                data += self.socket.recv(msg_length)
-            data = self.buffer + data
-            return self.unpack(data)
+            frame = self.buffer.next_frame()
+            while frame is None:
+                self.fill()
+                frame = self.buffer.next_frame()
         except socket.timeout:
             return None
+        except socket.error as error:
+            if error.errno in self.blocking_errors:
+                return None
+            raise
+        msg_type, payload = frame
+        if raw and not msg_type & EVENT_FLAG:
+            return msg_type, payload.tobytes()  # copied, the buffer gets reused
+        return msg_type, self.decode(payload)
+    
+    def poll(self, timeout=None):
+        """
+        Same as "socket.receive_message", but waits for at most timeout
+        seconds in total (forever if None) using select, regardless of the
+        socket timeout. Returns None if no whole message arrived in time.
+        """
+        if self.queued_events:
+            return self.queued_events.popleft()
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        frame = self.buffer.next_frame()
+        while frame is None:
+            self.ensure_connected()
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+            if select.select([self.socket], [], [], remaining)[0]:
+                self.fill()
+            frame = self.buffer.next_frame()
+        msg_type, payload = frame
+        return msg_type, self.decode(payload)
+    
+    def fill(self):
+        """
+        Reads from the socket straight into the receive buffer. Reads at
+        least chunk_size bytes or the rest of the current message, whichever
+        is larger. Raises socket.error when i3 closes the connection.
+        """
+        self.ensure_connected()
+        size = max(self.chunk_size, self.buffer.missing())
+        try:
+            count = self.socket.recv_into(self.buffer.reserve(size))
+        except socket.timeout:
+            raise
+        except socket.error as error:
+            if error.errno not in self.blocking_errors:
+                self.drop()
+            raise
+        if not count:
+            self.drop()
+            raise socket.error(errno.ECONNRESET, 'Connection closed by i3')
+        self.buffer.commit(count)
+        return count
     
     def pack(self, msg_type, payload):
         """
         Packs the given message type and payload. Turns the resulting
         message into a byte string.
         """
-        msg_magic = self.magic_string
-        # Get the byte count instead of number of characters
-        msg_length = len(payload.encode('utf-8'))
-        msg_type = parse_msg_type(msg_type)
-        # "struct.pack" returns byte string, decoding it for concatenation
-        msg_length = struct.pack('I', msg_length).decode('utf-8')
-        msg_type = struct.pack('I', msg_type).decode('utf-8')
-        message = '%s%s%s%s' % (msg_magic, msg_length, msg_type, payload)
-        # Encoding the message back to byte string
-        return message.encode('utf-8')
+        payload = self.encode(payload)
+        header = self.header.pack(self.magic, len(payload),
+                                  parse_msg_type(msg_type))
+        return header + bytes(payload)
     
-    def unpack(self, data):
+    def encode(self, payload):
         """
-        Unpacks the given byte string and parses the result from JSON.
-        Returns None on failure and saves data into "self.buffer".
-        """
-        data_size = len(data)
-        msg_magic, msg_length, msg_type = self.unpack_header(data)
-        msg_size = self.struct_header_size + msg_length
-        # Message shouldn't be any longer than the data
-        if data_size >= msg_size:
-            payload = data[self.struct_header_size:msg_size].decode('utf-8')
-            payload = json.loads(payload)
-            self.buffer = data[msg_size:]
+        Returns the payload as a byte buffer. Strings are encoded to UTF-8,
+        byte strings and memoryviews are returned as they are (memoryviews
+        of wider items are cast to bytes).
+        """
+        if isinstance(payload, memoryview):
+            if payload.itemsize != 1:
+                payload = payload.cast('B')
             return payload
-        else:
-            self.buffer = data
+        if isinstance(payload, (bytes, bytearray)):
+            return payload
+        return payload.encode('utf-8')
+    
+    def unpack(self, data):
+        """
+        Adds the given byte string to "self.buffer" and returns the next
+        complete message, parsed from JSON. Returns None if there isn't one
+        yet; the data stays buffered either way.
+        """
+        self.buffer.feed(data)
+        frame = self.buffer.next_frame()
+        if frame is None:
             return None
+        msg_type, payload = frame
+        return self.decode(payload)
+    
+    def decode(self, payload):
+        """
+        Parses the given payload (a byte string or memoryview) from JSON,
+        using the socket's codec.
+        """
+        return self.codec.loads(payload)
     
     def unpack_header(self, data):
         """
-        Unpacks the header of given byte string.
+        Unpacks the header of given byte string. Returns a (magic_string,
+        length, msg_type) tuple. The high bit of msg_type (i3.EVENT_FLAG)
+        is set for events, see i3.event_type_of.
         """
         return struct.unpack(self.struct_header, data[:self.struct_header_size])
     
+    def is_connected(self):
+        """
+        Returns True if connected and False if not. Only checks the
+        connection state, nothing is sent to i3-wm.
+        """
+        return self.state == 'connected'
+    
     @property
     def connected(self):
         """
-        Returns True if connected and False if not.
+        Returns True if connected and False if not. See "is_connected".
         """
-        try:
-            self.get('command')
+        return self.is_connected()
+    
+    def close(self):
+        """
+        Closes the socket connection.
+        """
+        self.state = 'closed'
+        if self.socket:
+            self.socket.close()
+
+
+class SocketPool(object):
+    """
+    Thread-safe pool of i3.Socket objects, so that any number of threads can
+    talk to i3-wm at once without sharing a connection. Example:
+      pool = i3.SocketPool(size=4)
+      with pool.connection() as socket:
+          tree = socket.get('get_tree')
+    or just "pool.get('get_tree')". Sockets are created (lazily) as needed,
+    up to the pool size; after that threads wait for one to be checked in.
+    A socket that is checked in disconnected or with unread data (e.g. the
+    late reply to a timed out request) is closed instead of reused.
+    Optional arguments:
+    - size, the most sockets open at the same time
+    - path of the i3 socket and timeout of the sockets, see i3.Socket
+    - affinity, if True a thread gets the socket it used last if it's idle
+    - sockets to start the pool with
+    Checkout, creation and discard counts are kept in the attributes of the
+    same name.
+    """
+    size = 4
+    
+    def __init__(self, size=None, path=None, timeout=None, affinity=False,
+                 sockets=None):
+        if size:
+            self.size = size
+        self.path = path
+        self.timeout = timeout
+        self.affinity = affinity
+        self.idle = list(sockets or [])
+        self.count = len(self.idle)  # sockets idle or checked out
+        self.condition = threading.Condition()
+        self.local = threading.local()  # the socket a thread used last
+        self.closed = False
+        self.checkouts = 0
+        self.creations = 0
+        self.discards = 0
+    
+    def checkout(self, timeout=None):
+        """
+        Returns an idle socket, or a new one if the pool isn't full yet.
+        Otherwise waits for at most timeout seconds (forever if None) and
+        raises socket.timeout if no socket was checked in.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise socket.error(errno.ENOTCONN, 'Socket pool is closed')
+                if self.idle:
+                    self.checkouts += 1
+                    last = getattr(self.local, 'socket', None)
+                    if self.affinity and last in self.idle:
+                        self.idle.remove(last)
+                        return last
+                    return self.idle.pop()
+                if self.count < self.size:
+                    self.count += 1
+                    self.checkouts += 1
+                    self.creations += 1
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise socket.timeout('No socket available')
+                self.condition.wait(remaining)
+        return Socket(self.path, self.timeout, lazy=True)
+    
+    def checkin(self, sock):
+        """
+        Returns the given socket to the pool, or closes it if it isn't fit
+        for reuse.
+        """
+        healthy = self.healthy(sock)
+        with self.condition:
+            if healthy and not self.closed:
+                self.idle.append(sock)
+                self.local.socket = sock
+            else:
+                self.count -= 1
+                self.discards += 1
+            self.condition.notify()
+        if not healthy or self.closed:
+            sock.close()
+    
+    def discard(self, sock):
+        """
+        Closes the given checked out socket instead of returning it.
+        """
+        sock.close()
+        self.checkin(sock)
+    
+    def healthy(self, sock):
+        """
+        Returns True if the given socket can be reused: it is connected (or
+        not yet) and nothing is waiting to be read from it.
+        """
+        if sock.state == 'idle':
             return True
-        except socket.error:
+        if sock.state != 'connected':
+            return False
+        if len(sock.buffer) or sock.queued_events or sock.outgoing:
             return False
+        return not select.select([sock.socket], [], [], 0)[0]
+    
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """
+        Checks out a socket for the duration of a with block.
+        """
+        sock = self.checkout(timeout)
+        try:
+            yield sock
+        finally:
+            self.checkin(sock)
+    
+    def get(self, msg_type, payload=''):
+        """
+        Same as "socket.get", on a pooled socket.
+        """
+        return self.get_many([(msg_type, payload)])[0]
+    
+    def get_raw(self, msg_type, payload=''):
+        """
+        Same as "socket.get_raw", on a pooled socket.
+        """
+        sock = self.checkout()
+        try:
+            response = sock.get_raw(msg_type, payload)
+        except Exception:
+            self.discard(sock)
+            raise
+        if response is None:
+            self.discard(sock)
+        else:
+            self.checkin(sock)
+        return response
+    
+    def get_many(self, requests):
+        """
+        Same as "socket.get_many", on a pooled socket.
+        """
+        sock = self.checkout()
+        try:
+            responses = sock.get_many(requests)
+        except Exception:
+            self.discard(sock)
+            raise
+        if None in responses:
+            self.discard(sock)  # a late reply would be taken for the next one
+        else:
+            self.checkin(sock)
+        return responses
     
     def close(self):
         """
-        Closes the socket connection.
+        Closes the idle sockets, checked out ones are closed on checkin.
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+            self.condition.notify_all()
+        for sock in idle:
+            sock.close()
+
+
+class Future(object):
+    """
+    The result of a request sent through an i3.MultiplexedSocket, which
+    becomes available once the reply comes in.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+    
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+    
+    def set_exception(self, error):
+        self.error = error
+        self.event.set()
+    
+    def done(self):
+        """
+        Returns True if the reply (or an error) came in.
+        """
+        return self.event.is_set()
+    
+    def result(self, timeout=None):
+        """
+        Waits for at most timeout seconds (forever if None) and returns the
+        reply. Raises socket.timeout if it didn't come in time, or the error
+        the connection failed with.
+        """
+        self.event.wait(timeout)
+        if not self.event.is_set():
+            raise socket.timeout('No reply within %s seconds' % timeout)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class MultiplexedSocket(object):
+    """
+    A single connection to i3-wm shared by any number of threads. Requests
+    are written as they're made and a reader thread hands the replies out
+    in the same order, so callers only wait for their own reply instead of
+    holding a lock for the whole round trip. Events are passed to
+    handlers, see "add_handler". Example:
+      shared = i3.MultiplexedSocket()
+      tree = shared.get('get_tree')  # from any thread
+      future = shared.submit('get_marks')
+      marks = future.result()
+    Optional arguments:
+    - path of the i3 socket, see i3.Socket
+    - timeout in seconds to wait for a reply in "get"
+    Handlers are called on the reader thread, so they should be quick.
+    """
+    timeout = 0.5  # in seconds
+    
+    def __init__(self, path=None, timeout=None):
+        if timeout:
+            self.timeout = timeout
+        self.socket = Socket(path)
+        self.path = self.socket.path
+        self.codec = self.socket.codec
+        self.pending = collections.deque()  # futures, oldest first
+        self.pending_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        # Handlers run on the reader thread, which can't wait for its own
+        # replies, so data is retrieved over a separate connection
+        self.data_socket = Socket(self.path, lazy=True, codec=self.codec)
+        self.dispatcher = EventDispatcher(self, self.data_socket, start=False)
+        self.closed = False  # by "close"
+        self.stopped = False  # the reader, after "close" or a failure
+        self.thread = threading.Thread(target=self.listen)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def submit_many(self, requests):
+        """
+        Sends the given (msg_type, payload) tuples (or just message types)
+        at once. Returns a list of i3.Future objects of the replies.
+        """
+        buffers = []
+        for request in requests:
+            if isinstance(request, (tuple, list)):
+                buffers += self.socket.frame(*request)
+            else:
+                buffers += self.socket.frame(request)
+        futures = [Future() for buffer in buffers[::2]]
+        with self.write_lock:
+            # Queued before writing, the reader may get a reply right away
+            with self.pending_lock:
+                if self.closed or self.stopped:
+                    raise socket.error(errno.ENOTCONN, 'Socket is closed')
+                self.pending.extend(futures)
+            try:
+                self.socket.write(*buffers)
+            except Exception:
+                with self.pending_lock:
+                    for future in futures:
+                        if future in self.pending:
+                            self.pending.remove(future)
+                raise
+        return futures
+    
+    def submit(self, msg_type, payload=''):
+        """
+        Sends the given message type and payload, returns an i3.Future of
+        the reply.
+        """
+        return self.submit_many([(msg_type, payload)])[0]
+    
+    def send(self, msg_type, payload=''):
+        """
+        Sends the given message type and payload, ignores the reply.
+        """
+        self.submit(msg_type, payload)
+    
+    def get(self, msg_type, payload=''):
         """
+        Same as "socket.get": returns the reply, None on timeout.
+        """
+        try:
+            return self.submit(msg_type, payload).result(self.timeout)
+        except socket.timeout:
+            return None
+    
+    def get_many(self, requests):
+        """
+        Same as "socket.get_many": returns the replies, None for each one
+        that timed out.
+        """
+        deadline = time.time() + self.timeout
+        replies = []
+        for future in self.submit_many(requests):
+            try:
+                replies.append(future.result(max(deadline - time.time(), 0)))
+            except socket.timeout:
+                replies.append(None)
+        return replies
+    
+    def add_handler(self, callback, event_type, event=None, data=False):
+        """
+        Adds an event handler, see "EventDispatcher.add_handler".
+        """
+        return self.dispatcher.add_handler(callback, event_type, event, data)
+    
+    def remove_handler(self, handler):
+        """
+        Removes an event handler, see "EventDispatcher.remove_handler".
+        """
+        self.dispatcher.remove_handler(handler)
+    
+    def listen(self):
+        """
+        Reader loop, passes replies to the oldest waiting future and events
+        to the dispatcher. Fails the waiting futures with the error the
+        reader stopped with, whatever it is.
+        """
+        error = socket.error(errno.ENOTCONN, 'Socket is closed')
+        try:
+            while not self.closed:
+                message = self.socket.receive_message()
+                if message is None:
+                    continue
+                msg_type, data = message
+                event_type = event_type_of(msg_type)
+                if event_type:
+                    self.dispatcher.dispatch(event_type, data)
+                    continue
+                with self.pending_lock:
+                    future = self.pending.popleft() if self.pending else None
+                if future:
+                    future.set_result(data)
+        except Exception as exception:
+            error = exception
+        finally:
+            with self.pending_lock:
+                self.stopped = True
+                pending, self.pending = self.pending, collections.deque()
+            for future in pending:
+                future.set_exception(error)
+    
+    def is_connected(self):
+        """
+        Returns True if connected and False if not.
+        """
+        return not self.stopped and self.socket.is_connected()
+    
+    def close(self):
+        """
+        Stops the reader and closes the connections.
+        """
+        if self.closed:
+            return
+        self.closed = True
         self.socket.close()
+        self.dispatcher.close()
+        self.data_socket.close()
 
 
 class Subscription(threading.Thread):
@@ -286,16 +1198,27 @@ class Subscription(threading.Thread):
     event_type = 'workspace'
     event = 'focus'
     event_socket = <i3.Socket object>
-    data_socket = <i3.Socket object>
+    data_socket = <i3.Socket or i3.SocketPool object>
+    executor = <i3.CallbackExecutor object>
+    debounce = 0.02
+    max_latency = 0.25
+    With an executor, the listener only reads events and queues them, data
+    is retrieved and the callback is called on the executor's workers (see
+    i3.CallbackExecutor). Events are coalesced by their type and change.
+    With debounce (in seconds), events are collected until none has come in
+    for that long, but for no longer than max_latency seconds. The callback
+    then gets the list of collected events, with data retrieved only once.
     """
     subscribed = False
-    type_translation = {
+    max_latency = 0.25  # in seconds, when debouncing
+    type_translation = {  # other event types come without data
         'workspace': 'get_workspaces',
         'output': 'get_outputs'
     }
     
     def __init__(self, callback, event_type, event=None, event_socket=None,
-                 data_socket=None):
+                 data_socket=None, executor=None, debounce=None,
+                 max_latency=None):
         # Variable initialization
         if not callable(callback):
             raise TypeError('Callback must be callable')
@@ -303,13 +1226,18 @@ class Subscription(threading.Thread):
         self.callback = callback
         self.event_type = event_type
         self.event = event
+        self.executor = executor
+        self.debounce = debounce
+        if max_latency:
+            self.max_latency = max_latency
+        self.data_lock = threading.Lock()  # executor workers share data_socket
         # Socket initialization
         if not event_socket:
             event_socket = Socket()
         self.event_socket = event_socket
         self.event_socket.subscribe(event_type, event)
         if not data_socket:
-            data_socket = Socket()
+            data_socket = default_pool()
         self.data_socket = data_socket
         # Thread initialization
         threading.Thread.__init__(self)
@@ -335,26 +1263,2030 @@ class Subscription(threading.Thread):
         """
         self.subscribed = True
         while self.subscribed:
-            event = self.event_socket.receive()
+            if self.debounce:
+                event = self.collect()
+            else:
+                event = self.event_socket.receive()
             if not event:  # skip an iteration if event is None
                 continue
-            if not self.event or ('change' in event and event['change'] == self.event):
-                msg_type = self.type_translation[self.event_type]
-                data = self.data_socket.get(msg_type)
+            if self.executor and not self.debounce:
+                key = (self.event_type, event.get('change'))
+                self.executor.submit(self.deliver, event, key=key)
+            elif self.executor:
+                self.executor.submit(self.deliver, event)
             else:
-                data = None
-            self.callback(event, data, self)
+                self.deliver(event)
         self.close()
     
-    def close(self):
+    def collect(self):
         """
-        Ends subscription loop by setting self.subscribed to False and
-        closing both sockets.
+        Collects events until none has arrived for debounce seconds or
+        max_latency seconds have passed since the first one. Returns the
+        list of events, which is empty if none arrived within the socket
+        timeout.
         """
-        self.subscribed = False
+        events = []
+        first = last = None
+        while self.subscribed:
+            if events:
+                deadline = min(last + self.debounce, first + self.max_latency)
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+            else:
+                timeout = self.event_socket.timeout
+            message = self.event_socket.poll(timeout)
+            if message is None:
+                if not events:
+                    break
+                continue
+            last = time.time()
+            if not events:
+                first = last
+            events.append(message[1])
+        return events
+    
+    def matches(self, event):
+        """
+        Returns True if data should be retrieved for the given event.
+        """
+        return not self.event or ('change' in event and event['change'] == self.event)
+    
+    def deliver(self, event):
+        """
+        Retrieves the data matching the event (or list of debounced events)
+        if needed and calls the callback.
+        """
+        if isinstance(event, list):
+            matches = any(self.matches(item) for item in event)
+        else:
+            matches = self.matches(event)
+        msg_type = self.type_translation.get(self.event_type)
+        if matches and msg_type:
+            with self.data_lock:
+                data = self.data_socket.get(msg_type)
+        else:
+            data = None
+        self.callback(event, data, self)
+    
+    def close(self):
+        """
+        Ends subscription loop by setting self.subscribed to False and
+        closing both sockets (a pool used as data socket is left open).
+        """
+        self.subscribed = False
+        self.event_socket.close()
+        if (isinstance(self.data_socket, Socket) and
+                self.data_socket is not default_socket()):
+            self.data_socket.close()
+
+
+class CallbackExecutor(object):
+    """
+    Bounded queue in front of a pool of worker threads, so that slow
+    callbacks don't keep the event socket from being drained (i3-wm drops
+    clients that don't read their events). Example:
+      executor = i3.CallbackExecutor(workers=2, overflow='coalesce')
+      i3.Subscription(callback, 'workspace', executor=executor)
+    Optional arguments:
+    - workers, number of worker threads
+    - maxsize of the queue
+    - overflow policy, what happens to a call when the queue is full:
+      - 'block', waits until there's room
+      - 'drop_oldest', drops the oldest queued call
+      - 'coalesce', waits like 'block'. With this policy a queued call
+        with the same function and key is always replaced by the new one,
+        whether the queue is full or not, so only the latest state gets
+        delivered.
+    Counters: "executor.depth" (calls queued right now), "executor.max_depth",
+    "executor.dropped" and "executor.coalesced".
+    """
+    overflow_policies = ['block', 'drop_oldest', 'coalesce']
+    
+    def __init__(self, workers=1, maxsize=64, overflow='block'):
+        if overflow not in self.overflow_policies:
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.queue = collections.deque()  # [function, args, pending key]
+        self.pending = {}  # (function, key) -> queued call, when coalescing
+        self.condition = threading.Condition()
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.running = True
+        self.threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    
+    @property
+    def depth(self):
+        """
+        Number of queued calls.
+        """
+        return len(self.queue)
+    
+    def submit(self, function, *args, **options):
+        """
+        Queues a call of function with the given args. The key keyword
+        argument identifies calls that can be coalesced, see the 'coalesce'
+        overflow policy.
+        """
+        key = options.get('key')
+        pending_key = None
+        if self.overflow == 'coalesce' and key is not None:
+            pending_key = (function, key)
+        with self.condition:
+            if not self.running:
+                raise RuntimeError('Executor is closed')
+            if pending_key in self.pending:
+                self.pending[pending_key][1] = args
+                self.coalesced += 1
+                return
+            while len(self.queue) >= self.maxsize:
+                if self.overflow == 'drop_oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.condition.wait()
+            call = [function, args, pending_key]
+            self.queue.append(call)
+            if pending_key is not None:
+                self.pending[pending_key] = call
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.condition.notify_all()
+    
+    def work(self):
+        """
+        Worker loop, runs queued calls until the executor is closed and the
+        queue is empty. Exceptions are printed.
+        """
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                function, args, pending_key = self.queue.popleft()
+                self.pending.pop(pending_key, None)
+                self.condition.notify_all()
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc()
+    
+    def close(self, wait=True):
+        """
+        Stops the workers once the queue is empty. Waits for them unless
+        wait is False.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+
+class EventDispatcher(object):
+    """
+    Routes events to any number of handlers over a single event socket and a
+    single listener thread. The socket is subscribed once to each event type
+    some handler is interested in, handlers can be added and removed at any
+    time. Example:
+      dispatcher = i3.EventDispatcher()
+      dispatcher.add_handler(callback, 'workspace', 'focus')
+      dispatcher.add_handler(other_callback, 'output')
+    Handlers are called like i3.Subscription callbacks, with the event, data
+    (see "add_handler") and the dispatcher itself.
+    Optional arguments:
+    - event_socket for listening to events. A new socket is created if not
+      given.
+    - data_socket for retrieving data. A new socket is created (on first
+      use) if not given.
+    - start, set to False to start listening later with "dispatcher.start()"
+    """
+    def __init__(self, event_socket=None, data_socket=None, start=True):
+        if not event_socket:
+            event_socket = Socket()
+        self.event_socket = event_socket
+        self.own_data_socket = not data_socket
+        if not data_socket:
+            data_socket = Socket(event_socket.path, lazy=True,
+                                 codec=event_socket.codec)
+        self.data_socket = data_socket
+        self.handlers = {}  # event type -> list of handlers
+        self.subscribed = set()
+        self.lock = threading.Lock()
+        self.listening = False
+        self.thread = None
+        if start:
+            self.start()
+    
+    def add_handler(self, callback, event_type, event=None, data=False):
+        """
+        Adds a handler for the given event type. If event is given, only
+        events with the same 'change' are passed on. If data is True, the
+        callback gets the data matching the event type (see
+        "Subscription.type_translation"), retrieved once per event no
+        matter how many handlers ask for it. Returns the handler, which can
+        be passed to "dispatcher.remove_handler".
+        """
+        if not callable(callback):
+            raise TypeError('Callback must be callable')
+        event_type = parse_event_type(event_type)
+        handler = (callback, event_type, event, data)
+        with self.lock:
+            self.handlers.setdefault(event_type, []).append(handler)
+            subscribe = event_type not in self.subscribed
+            self.subscribed.add(event_type)
+        if subscribe:
+            # The reply is skipped by the listener
+            event_types = self.event_socket.codec.dumps([event_type])
+            self.event_socket.send('subscribe', event_types)
+        return handler
+    
+    def remove_handler(self, handler):
+        """
+        Removes the given handler. i3-wm can't unsubscribe, so events of its
+        type are still received (and dropped) if it was the last one.
+        """
+        with self.lock:
+            handlers = self.handlers.get(handler[1], [])
+            if handler in handlers:
+                handlers.remove(handler)
+    
+    def dispatch(self, event_type, event):
+        """
+        Calls the handlers of the given event type and event. Exceptions
+        raised by handlers are printed and don't affect other handlers. If
+        the data can't be retrieved, it is printed as well and handlers get
+        None as data.
+        """
+        with self.lock:
+            handlers = list(self.handlers.get(event_type, []))
+        data = None
+        fetched = False
+        for callback, _, change, wants_data in handlers:
+            if change and event.get('change') != change:
+                continue
+            if wants_data and not fetched:
+                fetched = True
+                msg_type = Subscription.type_translation.get(event_type)
+                try:
+                    if msg_type:
+                        data = self.data_socket.get(msg_type)
+                except Exception:
+                    traceback.print_exc()
+            try:
+                callback(event, data if wants_data else None, self)
+            except Exception:
+                traceback.print_exc()
+    
+    def start(self):
+        """
+        Starts the listener thread.
+        """
+        self.listening = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+    
+    def run(self):
+        """
+        Wrapper method for the listen method -- handles exceptions.
+        """
+        try:
+            self.listen()
+        except socket.error:
+            self.close()
+    
+    def listen(self):
+        """
+        Runs the listener loop until the dispatcher is closed. Replies to
+        subscribe messages are skipped, events are dispatched.
+        """
+        while self.listening:
+            message = self.event_socket.receive_message()
+            if message is None:
+                continue
+            msg_type, event = message
+            event_type = event_type_of(msg_type)
+            if event_type:
+                self.dispatch(event_type, event)
+    
+    def close(self):
+        """
+        Stops the listener and closes the sockets the dispatcher created.
+        """
+        global __dispatcher__
+        self.listening = False
+        self.event_socket.close()
+        if self.own_data_socket:
+            self.data_socket.close()
+        if __dispatcher__ is self:
+            __dispatcher__ = None
+
+
+class EventStream(object):
+    """
+    Iterates over events on the calling thread, no listener thread needed:
+      for event_type, event in i3.EventStream(['workspace', 'output']):
+          print(event_type, event['change'])
+    The socket is subscribed right away, so no event is missed between
+    creating the stream and iterating over it. Iteration stops when no event
+    arrives within the timeout; breaking out of the loop closes the stream.
+    Optional arguments:
+    - timeout in seconds to wait for each event, forever if None
+    - event_socket to subscribe. A new socket is created if not given.
+    """
+    barriers = itertools.count(1)
+    
+    def __init__(self, event_types, timeout=None, event_socket=None):
+        self.event_types = [parse_event_type(event_type) for event_type in event_types]
+        self.timeout = timeout
+        if not event_socket:
+            event_socket = Socket()
+        self.event_socket = event_socket
+        event_types = self.event_socket.codec.dumps(self.event_types)
+        self.event_socket.get('subscribe', event_types)
+        self.ticks = 'tick' in self.event_types  # subscribed to ticks
+    
+    def __iter__(self):
+        try:
+            while True:
+                message = self.get(self.timeout)
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def get(self, timeout=None):
+        """
+        Returns the next event as an (event_type, event) tuple, waiting for
+        at most timeout seconds (forever if None). Returns None on timeout.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            message = self.event_socket.poll(remaining)
+            if message is None:
+                return None
+            msg_type, event = message
+            event_type = event_type_of(msg_type)
+            if event_type in self.event_types:
+                return event_type, event
+    
+    def wait_for(self, predicate=None, timeout=None):
+        """
+        Returns the first event for which predicate(event) is true (any
+        event if there's no predicate), None if none came within timeout
+        seconds. Events before it are dropped.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            message = self.get(remaining)
+            if message is None or not predicate or predicate(message[1]):
+                return message and message[1]
+    
+    def barrier(self, timeout=None):
+        """
+        Sends a tick to i3-wm and returns the list of (event_type, event)
+        tuples received before the tick came back. Since i3-wm handles
+        messages in order, these are all the events caused by whatever was
+        sent to it before. Returns None if the tick didn't come back within
+        timeout seconds.
+        """
+        if not self.ticks:
+            event_types = self.event_socket.codec.dumps(['tick'])
+            self.event_socket.get('subscribe', event_types)
+            self.ticks = True
+        payload = 'i3-py barrier %d %d' % (os.getpid(), next(self.barriers))
+        self.event_socket.get('send_tick', payload)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        events = []
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            message = self.event_socket.poll(remaining)
+            if message is None:
+                return None
+            msg_type, event = message
+            event_type = event_type_of(msg_type)
+            if event_type == 'tick' and event.get('payload') == payload:
+                return events
+            if event_type in self.event_types:
+                events.append((event_type, event))
+    
+    def close(self):
+        """
+        Closes the event socket.
+        """
+        self.event_socket.close()
+
+
+class Rect(collections.namedtuple('Rect', ['x', 'y', 'width', 'height'])):
+    """
+    Rectangle of an i3.Node, a tuple of x, y, width and height. It can be
+    used like the dict it replaces as well: rect['width'], rect.get('x'),
+    and it compares equal to a dict with the same values.
+    """
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return tuple.__getitem__(self, key)
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self._asdict() == other
+        return tuple.__eq__(self, other)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    __hash__ = tuple.__hash__
+    
+    def get(self, key, default=None):
+        """
+        Returns the value of the given key, or default if there's none.
+        """
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+    
+    def keys(self):
+        """
+        Returns the list of keys, same as of the dict.
+        """
+        return list(self._fields)
+    
+    def to_dict(self):
+        """
+        Returns the rectangle as a dict.
+        """
+        return dict(self._asdict())
+
+
+class Node(object):
+    """
+    Compact container of a decoded tree, for keeping trees around for long
+    (e.g. "i3.TreeCache(compact=True)"). Keys known from i3-wm are stored in
+    slots instead of a dict, rectangles as i3.Rect tuples, and repeated
+    strings (types, layouts, outputs, window classes...) are shared. Any
+    other key goes to a dict of its own.
+    Nodes are used like dicts, so i3.filter, i3.Query and i3.Tree (and
+    predicates written as node['name']) work with them:
+      tree = i3.Node(i3.msg('get_tree'))
+      windows = i3.filter(tree, nodes=[])
+    Children are converted along with their parent, "node.to_dict()" does
+    the opposite.
+    """
+    fields = ['id', 'type', 'orientation', 'scratchpad_state', 'percent',
+              'urgent', 'marks', 'focused', 'output', 'layout',
+              'workspace_layout', 'last_split_layout', 'border',
+              'current_border_width', 'rect', 'deco_rect', 'window_rect',
+              'geometry', 'name', 'window_icon_padding', 'num', 'gaps',
+              'window', 'window_type', 'window_properties', 'nodes',
+              'floating_nodes', 'focus', 'fullscreen_mode', 'sticky',
+              'floating', 'swallows']
+    __slots__ = fields + ['__extra__']
+    field_set = frozenset(fields)
+    rect_fields = frozenset(['rect', 'deco_rect', 'window_rect', 'geometry'])
+    shared_fields = frozenset(['type', 'orientation', 'scratchpad_state', 'output',
+                               'layout', 'workspace_layout', 'last_split_layout',
+                               'border', 'window_type', 'floating'])
+    shared_properties = frozenset(['class', 'instance', 'window_role'])
+    converted_fields = rect_fields | shared_fields | frozenset(
+        ['nodes', 'floating_nodes', 'window_properties'])
+    plain_fields = field_set - converted_fields
+    strings = {}  # shared strings
+    max_strings = 4096  # strings shared at most, the table starts over after
+    
+    def __init__(self, data=None):
+        self.__extra__ = None
+        if data:
+            plain = self.plain_fields
+            for key, value in data.items():
+                if key in plain:
+                    setattr(self, key, value)
+                else:
+                    self[key] = value
+    
+    @classmethod
+    def share(cls, value):
+        """
+        Returns the shared copy of the given string, other values are
+        returned as they are.
+        """
+        if not isinstance(value, TEXT_TYPES):
+            return value
+        strings = cls.strings
+        if len(strings) >= cls.max_strings:
+            strings.clear()
+        return strings.setdefault(value, value)
+    
+    def __getitem__(self, key):
+        if key in self.field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.__extra__ is None:
+            raise KeyError(key)
+        return self.__extra__[key]
+    
+    def __setitem__(self, key, value):
+        if key in self.rect_fields:
+            if isinstance(value, dict) and sorted(value) == ['height', 'width', 'x', 'y']:
+                value = Rect(value['x'], value['y'], value['width'], value['height'])
+        elif key in self.shared_fields:
+            value = self.share(value)
+        elif key in ('nodes', 'floating_nodes') and isinstance(value, list):
+            value = [child if isinstance(child, Node) else Node(child) for child in value]
+        elif key == 'window_properties' and isinstance(value, dict):
+            value = dict((name, self.share(item) if name in self.shared_properties else item)
+                         for name, item in value.items())
+        if key in self.field_set:
+            setattr(self, key, value)
+        else:
+            if self.__extra__ is None:
+                self.__extra__ = {}
+            self.__extra__[key] = value
+    
+    def __contains__(self, key):
+        if key in self.field_set:
+            return hasattr(self, key)
+        return self.__extra__ is not None and key in self.__extra__
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __repr__(self):
+        return '<i3.Node %s>' % self.get('id')
+    
+    def get(self, key, default=None):
+        """
+        Returns the value of the given key, or default if there's none.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        """
+        Returns a list of the node's keys.
+        """
+        keys = [key for key in self.fields if hasattr(self, key)]
+        if self.__extra__:
+            keys.extend(self.__extra__)
+        return keys
+    
+    def items(self):
+        """
+        Returns a list of the node's (key, value) pairs.
+        """
+        return [(key, self[key]) for key in self.keys()]
+    
+    def to_dict(self):
+        """
+        Returns the node and its children as dicts, like they come from
+        "i3.msg('get_tree')".
+        """
+        result = {}
+        for key, value in self.items():
+            if isinstance(value, Rect):
+                value = value.to_dict()
+            elif key in ('nodes', 'floating_nodes') and isinstance(value, list):
+                value = [node.to_dict() if isinstance(node, Node) else node
+                         for node in value]
+            result[key] = value
+        return result
+
+
+class Tree(object):
+    """
+    Indexed tree, built in a single pass over a "get_tree" reply. Containers
+    can be looked up by id, X window id, mark and workspace name, and so can
+    the parent of a container, all without scanning the tree.
+    Optional argument:
+    - tree as returned by "i3.msg('get_tree')", fetched if not given
+    Example (name of the focused window's workspace):
+      tree = i3.Tree()
+      focused = tree.filter(focused=True)[0]
+      print(tree.workspace_of(focused['id'])['name'])
+    """
+    child_keys = ['nodes', 'floating_nodes']
+    workspace_types = ['workspace', 4]  # older i3-wm used numeric types
+    
+    def __init__(self, tree=None):
+        if tree is None:
+            tree = msg('get_tree')
+        self.root = tree
+        self.nodes = {}  # con_id -> node
+        self.parents = {}  # con_id -> parent node
+        self.windows = {}  # X window id -> node
+        self.marks = {}  # mark -> node
+        self.workspaces = {}  # workspace name -> workspace node
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            self.nodes[node.get('id')] = node
+            if node.get('window'):
+                self.windows[node['window']] = node
+            for mark in node.get('marks', []):
+                self.marks[mark] = node
+            if node.get('mark'):
+                self.marks[node['mark']] = node
+            if node.get('type') in self.workspace_types:
+                self.workspaces[node.get('name')] = node
+            for key in self.child_keys:
+                for child in node.get(key, []):
+                    self.parents[child.get('id')] = node
+                    stack.append(child)
+    
+    def __getitem__(self, con_id):
+        return self.nodes[con_id]
+    
+    def __contains__(self, con_id):
+        return con_id in self.nodes
+    
+    def __len__(self):
+        return len(self.nodes)
+    
+    def __iter__(self):
+        return self.descendants()
+    
+    def get(self, con_id, default=None):
+        """
+        Returns the container with the given id.
+        """
+        return self.nodes.get(con_id, default)
+    
+    def parent(self, con_id):
+        """
+        Returns the parent of the given container, None for the root node or
+        an unknown id.
+        """
+        return self.parents.get(con_id)
+    
+    def window(self, window):
+        """
+        Returns the container of the given X window id.
+        """
+        return self.windows.get(window)
+    
+    def mark(self, mark):
+        """
+        Returns the container with the given mark.
+        """
+        return self.marks.get(mark)
+    
+    def workspace(self, name):
+        """
+        Returns the workspace container with the given name.
+        """
+        return self.workspaces.get(name)
+    
+    def workspace_of(self, con_id):
+        """
+        Returns the workspace the given container is on (the container
+        itself if it's a workspace).
+        """
+        node = self.nodes.get(con_id)
+        while node is not None:
+            if node.get('type') in self.workspace_types:
+                return node
+            node = self.parents.get(node.get('id'))
+        return None
+    
+    def ancestors(self, con_id):
+        """
+        Yields the parent of the given container, then its parent and so on
+        up to the root node.
+        """
+        node = self.parents.get(con_id)
+        while node is not None:
+            yield node
+            node = self.parents.get(node.get('id'))
+    
+    def descendants(self, con_id=None):
+        """
+        Yields every container below the given one, parents before their
+        children. Yields the whole tree, root node included, if no id is
+        given.
+        """
+        top = self.root if con_id is None else self.nodes[con_id]
+        stack = [top]
+        while stack:
+            node = stack.pop()
+            if node is not top or con_id is None:
+                yield node
+            for key in reversed(self.child_keys):
+                stack.extend(reversed(node.get(key, [])))
+    
+    def filter(self, function=None, **conditions):
+        """
+        Same as "i3.filter", run on this tree.
+        """
+        return filter(self.root, function, **conditions)
+
+
+class Query(object):
+    """
+    Compiled tree query, the engine behind "i3.filter". The conditions are
+    turned into a single predicate once and trees are traversed with an
+    explicit stack, producing matches lazily so a search can stop early.
+    As with "i3.filter", children of a matching node aren't searched.
+    Arguments (same as for "i3.filter"):
+    - function, takes a node and returns True for a match. Nodes for which
+      it raises KeyError or IndexError don't match.
+    - conditions as keyword arguments, a node matches if it has all of the
+      given keys with the given values
+    Optional argument:
+    - children, names of child lists to search, 'nodes' and
+      'floating_nodes' by default
+    Example:
+      focused = i3.Query(nodes=[], focused=True)
+      window = focused.first()
+    """
+    children = ['nodes', 'floating_nodes']
+    
+    def __init__(self, function=None, children=None, **conditions):
+        if children is not None:
+            self.children = list(children)
+        self.function = function
+        self.conditions = conditions
+        self.predicate = self.compile(function, conditions)
+    
+    def compile(self, function, conditions):
+        """
+        Returns a predicate function for the given function and conditions.
+        """
+        missing = object()
+        items = list(conditions.items())
+        if len(items) == 1:
+            (key, value), = items
+            def match(node):
+                return node.get(key, missing) == value
+        elif len(items) == 2:
+            (key, value), (key2, value2) = items
+            def match(node):
+                return (node.get(key, missing) == value and
+                        node.get(key2, missing) == value2)
+        else:
+            def match(node):
+                for key, value in items:
+                    if node.get(key, missing) != value:
+                        return False
+                return True
+        if not function:
+            return match
+        def predicate(node):
+            try:
+                return function(node) and (not items or match(node))
+            except (KeyError, IndexError):
+                return False
+        return predicate
+    
+    def iter(self, tree=None):
+        """
+        Yields matching nodes of the given tree (fetched if not given),
+        parents before their children. The tree can also be a list of nodes
+        or an i3.Tree.
+        """
+        if tree is None:
+            tree = msg('get_tree')
+        elif isinstance(tree, Tree):
+            tree = tree.root
+        if isinstance(tree, list):
+            stack = list(reversed(tree))
+        else:
+            stack = [tree]
+        predicate = self.predicate
+        children = list(reversed(self.children))
+        pop = stack.pop
+        extend = stack.extend
+        while stack:
+            node = pop()
+            if predicate(node):
+                yield node
+                continue
+            for key in children:
+                if key in node:
+                    extend(reversed(node[key]))
+    
+    __iter__ = iter
+    
+    def all(self, tree=None, limit=None):
+        """
+        Returns a list of matching nodes, at most limit of them if given.
+        """
+        matches = self.iter(tree)
+        if limit is not None:
+            matches = itertools.islice(matches, limit)
+        return list(matches)
+    
+    def first(self, tree=None):
+        """
+        Returns the first matching node or None. Stops searching at the first
+        match.
+        """
+        for node in self.iter(tree):
+            return node
+        return None
+
+
+class Batch(object):
+    """
+    Collects commands and sends them to i3-wm as a single message. Commands
+    are added the same way they are sent with the module, container criteria
+    included:
+      with i3.batch() as batch:
+          batch.focus(con_id=123)
+          batch.move('scratchpad')
+    The commands are sent when the with block ends (unless it raises) or on
+    "batch.send()". Each call returns the index of the command's result in
+    "batch.results", which holds True or False for each command, or the
+    i3.MessageError it failed with. Failed commands are also listed in
+    "batch.errors" as (command, error) tuples.
+    Optional arguments:
+    - socket to send commands through. Default pool is used if not given.
+    - max_payload in bytes. Batches that are larger are split into several
+      messages.
+    """
+    max_payload = 64 * 1024  # in bytes
+    separator = '; '
+    
+    def __init__(self, socket=None, max_payload=None):
+        self.socket = socket
+        if max_payload:
+            self.max_payload = max_payload
+        self.commands = []
+        self.results = []
+        self.errors = []
+    
+    def __getattr__(self, name):
+        """
+        Turns a nonexistent attribute into a function that adds a command.
+        """
+        if name.startswith('__'):
+            raise AttributeError(name)
+        def function(*args, **criteria):
+            return self.add(name, *args, **criteria)
+        function.__name__ = name
+        return function
+    
+    def __len__(self):
+        return len(self.commands)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.send()
+    
+    def add(self, *args, **criteria):
+        """
+        Adds a command made from the given args and container criteria.
+        Returns the index of its result.
+        """
+        self.commands.append(__compose__(' '.join(args), [], criteria))
+        return len(self.results) + len(self.commands) - 1
+    
+    def chunks(self, commands):
+        """
+        Splits the commands into lists that fit into max_payload when joined.
+        """
+        chunk = []
+        size = 0
+        for command in commands:
+            length = len(command.encode('utf-8')) + len(self.separator)
+            if chunk and size + length > self.max_payload:
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(command)
+            size += length
+        if chunk:
+            yield chunk
+    
+    def send(self):
+        """
+        Sends the collected commands. Returns their results.
+        """
+        socket = self.socket or default_pool()
+        commands, self.commands = self.commands, []
+        results = []
+        for chunk in self.chunks(commands):
+            while chunk:
+                response = socket.get('command', self.separator.join(chunk))
+                if not response:  # timed out
+                    response = [None] * len(chunk)
+                elif not isinstance(response, list):
+                    response = [response]
+                for command, item in zip(chunk, response):
+                    if item is None:
+                        item = MessageError('No reply to command: %s' % command)
+                    else:
+                        item = success(item)
+                    if isinstance(item, i3Exception):
+                        self.errors.append((command, item))
+                    results.append(item)
+                # A parse error stops i3-wm from running the rest of the
+                # message, so the rest is sent again on its own
+                chunk = chunk[len(response):]
+        self.results += results
+        return results
+
+
+class TreeCache(object):
+    """
+    Keeps the last decoded tree in memory. Once installed via
+    "i3.tree_cache(cache)", "i3.filter", "i3.parent" and "i3.msg('get_tree')"
+    are served from it instead of asking i3-wm every time.
+    A background thread listens to window, workspace and output events on its
+    own socket. Events that only change a single container (title, urgency,
+    marks) are patched into the cached tree, any other event invalidates it.
+    Optional arguments:
+    - max_age in seconds, the tree is fetched again once it gets older than
+      that, even without events. None to rely on events alone.
+    - socket for fetching the tree. Default pool is used if not given.
+    - event_socket for listening to events. A new socket is created if not
+      given.
+    - compact, if True the tree is kept as i3.Node objects instead of dicts
+    Hit, miss, patch and invalidation counts are kept in the attributes of
+    the same name. The cached tree is shared, so treat it as read-only.
+    """
+    event_types = ['window', 'workspace', 'output']
+    patch_changes = ['title', 'urgent', 'mark']
+    
+    def __init__(self, max_age=1.0, socket=None, event_socket=None, compact=False):
+        self.max_age = max_age
+        self.socket = socket
+        self.compact = compact
+        self.tree = None
+        self.indexed = (None, None)  # (tree, i3.Tree) of the last "index"
+        self.fetched = 0
+        self.generation = 0  # increased on every event
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self.invalidations = 0
+        # Event listener
+        if not event_socket:
+            event_socket = Socket()
+        self.event_socket = event_socket
+        event_types = self.event_socket.codec.dumps(self.event_types)
+        self.event_socket.get('subscribe', event_types)
+        self.listening = True
+        self.thread = threading.Thread(target=self.listen)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def get(self):
+        """
+        Returns the cached tree, fetches a new one if there isn't a fresh
+        one available.
+        """
+        with self.lock:
+            tree, generation = self.tree, self.generation
+            fresh = tree is not None and self.fresh()
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if fresh:
+            return tree
+        socket = self.socket or default_pool()
+        tree = socket.get('get_tree')
+        if self.compact and tree is not None:
+            tree = Node(tree)
+        with self.lock:
+            # Don't keep the tree if an event came in while fetching it
+            if self.generation == generation:
+                self.tree = tree
+                self.fetched = time.time()
+        return tree
+    
+    def index(self):
+        """
+        Returns the cached tree as an i3.Tree. The index is rebuilt only when
+        the cached tree changes.
+        """
+        tree = self.get()
+        with self.lock:
+            indexed_tree, index = self.indexed
+            if indexed_tree is not tree:
+                index = Tree(tree)
+                self.indexed = (tree, index)
+        return index
+    
+    def fresh(self):
+        """
+        Returns True if the cached tree can be served without asking i3-wm.
+        Without a working event listener only max_age can tell.
+        """
+        if self.max_age is None:
+            return self.listening
+        return time.time() - self.fetched < self.max_age
+    
+    def invalidate(self):
+        """
+        Drops the cached tree.
+        """
+        with self.lock:
+            self.tree = None
+            self.generation += 1
+            self.invalidations += 1
+    
+    def patch(self, container):
+        """
+        Updates the cached container with the same id as the given one (in
+        place). Returns False if the container isn't in the cached tree.
+        """
+        with self.lock:
+            # A tree being fetched may predate the change
+            self.generation += 1
+            if self.tree is None:
+                return True
+            nodes = [self.tree]
+            while nodes:
+                node = nodes.pop()
+                if node.get('id') == container['id']:
+                    for key, value in container.items():
+                        if key not in ('nodes', 'floating_nodes', 'focus'):
+                            node[key] = value
+                    self.patches += 1
+                    self.indexed = (None, None)  # marks may have changed
+                    return True
+                nodes.extend(node.get('nodes', []))
+                nodes.extend(node.get('floating_nodes', []))
+        return False
+    
+    def update(self, event):
+        """
+        Patches or invalidates the cached tree based on the given event.
+        """
+        container = event.get('container')
+        if container and event.get('change') in self.patch_changes:
+            if self.patch(container):
+                return
+        self.invalidate()
+    
+    def listen(self):
+        """
+        Runs the event listener loop until the cache is closed.
+        """
+        try:
+            while self.listening:
+                event = self.event_socket.receive()
+                if event:
+                    self.update(event)
+        except socket.error:
+            pass
+        self.listening = False
+        self.invalidate()
+    
+    def close(self):
+        """
+        Stops the event listener and uninstalls the cache if it's the one
+        used by the module.
+        """
+        global __tree_cache__
+        self.listening = False
+        self.event_socket.close()
+        if __tree_cache__ is self:
+            __tree_cache__ = None
+
+
+class WorkspaceState(object):
+    """
+    Keeps workspaces and outputs (as returned by "i3.get_workspaces()" and
+    "i3.get_outputs()") up to date from workspace and output events, so
+    reading them doesn't cost a round trip to i3-wm. Example:
+      state = i3.WorkspaceState(callback=lambda state: redraw(state))
+      workspaces, outputs = state.snapshot
+    Both are fetched once, after that workspace events (focus, init, empty,
+    urgent, rename, move) are applied in place. Whatever can't be applied
+    (an unknown workspace, a move of a visible workspace, output events...)
+    makes it fetch both again.
+    Optional arguments:
+    - socket for fetching data. Default pool is used if not given.
+    - event_socket for listening to events. A new socket is created if not
+      given.
+    - callback, called with the state after every change
+    The snapshot is a (workspaces, outputs) tuple of lists which is replaced
+    as a whole on every change, so it's always consistent. Treat it as
+    read-only. Event, applied event and resync counts are kept in
+    "state.events", "state.applied" and "state.resyncs".
+    """
+    event_types = ['workspace', 'output']
+    
+    def __init__(self, socket=None, event_socket=None, callback=None):
+        self.socket = socket
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.workspace_map = {}  # name -> workspace
+        self.output_map = {}  # name -> output
+        self.output_list = []
+        self.ids = {}  # container id -> workspace name
+        self.snapshot = ([], [])
+        self.events = 0
+        self.applied = 0
+        self.resyncs = 0
+        # Subscribe before fetching, events in between are applied after it
+        if not event_socket:
+            event_socket = Socket()
+        self.event_socket = event_socket
+        event_types = self.event_socket.codec.dumps(self.event_types)
+        self.event_socket.get('subscribe', event_types)
+        self.resync()
+        self.listening = True
+        self.thread = threading.Thread(target=self.listen)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def get_workspaces(self):
+        """
+        Returns the list of workspaces.
+        """
+        return self.snapshot[0]
+    
+    def get_outputs(self):
+        """
+        Returns the list of outputs.
+        """
+        return self.snapshot[1]
+    
+    def workspace(self, name):
+        """
+        Returns the workspace with the given name, None if there isn't one.
+        """
+        for workspace in self.snapshot[0]:
+            if workspace['name'] == name:
+                return workspace
+        return None
+    
+    def focused(self):
+        """
+        Returns the focused workspace.
+        """
+        for workspace in self.snapshot[0]:
+            if workspace['focused']:
+                return workspace
+        return None
+    
+    def resync(self):
+        """
+        Fetches workspaces and outputs from i3-wm.
+        """
+        socket = self.socket or default_pool()
+        workspaces, outputs = socket.get_many(['get_workspaces', 'get_outputs'])
+        with self.lock:
+            self.output_list = [dict(output) for output in outputs or []]
+            self.output_map = dict((output['name'], output) for output in self.output_list)
+            self.workspace_map = {}
+            self.ids = {}
+            for workspace in workspaces or []:
+                self.add(dict(workspace))
+            self.resyncs += 1
+            self.publish()
+    
+    def publish(self):
+        """
+        Replaces the snapshot with copies of the current state.
+        """
+        names = [output['name'] for output in self.output_list]
+        def order(workspace):
+            output = workspace['output']
+            position = names.index(output) if output in names else len(names)
+            return position, workspace['num'] < 0, workspace['num'], workspace['name']
+        workspaces = sorted(self.workspace_map.values(), key=order)
+        self.snapshot = ([dict(workspace) for workspace in workspaces],
+                         [dict(output) for output in self.output_list])
+    
+    def add(self, workspace):
+        """
+        Adds the given workspace to the state.
+        """
+        self.workspace_map[workspace['name']] = workspace
+        if 'id' in workspace:
+            self.ids[workspace['id']] = workspace['name']
+    
+    def output_of(self, container):
+        """
+        Returns the name of the output the given workspace container is on,
+        going by its rect if it doesn't say. None if that doesn't tell.
+        """
+        if container.get('output') in self.output_map:
+            return container['output']
+        rect = container.get('rect')
+        if not rect:
+            return None
+        for output in self.output_list:
+            area = output['rect']
+            if (output.get('active', True) and
+                    area['x'] <= rect['x'] < area['x'] + area['width'] and
+                    area['y'] <= rect['y'] < area['y'] + area['height']):
+                return output['name']
+        return None
+    
+    def apply(self, event_type, event):
+        """
+        Applies the given event to the state. Returns False if it can't be
+        applied.
+        """
+        if event_type != 'workspace':
+            return False
+        change = event.get('change')
+        current = event.get('current') or {}
+        name = current.get('name')
+        workspace = self.workspace_map.get(name)
+        if change == 'empty':
+            if workspace:
+                del self.workspace_map[name]
+                self.ids.pop(workspace.get('id'), None)
+            return True
+        if change == 'init':
+            if workspace:
+                return True
+            output = self.output_of(current)
+            if not output:
+                return False
+            workspace = {'num': current.get('num', -1), 'name': name,
+                         'visible': False, 'focused': False,
+                         'urgent': current.get('urgent', False),
+                         'rect': current.get('rect'), 'output': output}
+            if 'id' in current:
+                workspace['id'] = current['id']
+            self.add(workspace)
+            return True
+        if change == 'rename':
+            old_name = self.ids.get(current.get('id'))
+            if old_name not in self.workspace_map:
+                return False
+            workspace = self.workspace_map.pop(old_name)
+            workspace['name'] = name
+            workspace['num'] = current.get('num', workspace['num'])
+            self.add(workspace)
+            for output in self.output_list:
+                if output.get('current_workspace') == old_name:
+                    output['current_workspace'] = name
+            return True
+        if not workspace:
+            return False
+        if change == 'focus':
+            for other in self.workspace_map.values():
+                other['focused'] = False
+                if other['output'] == workspace['output']:
+                    other['visible'] = False
+            workspace['focused'] = workspace['visible'] = True
+            if workspace['output'] in self.output_map:
+                self.output_map[workspace['output']]['current_workspace'] = name
+            return True
+        if change == 'urgent':
+            workspace['urgent'] = current.get('urgent', False)
+            return True
+        if change == 'move':
+            output = self.output_of(current)
+            if not output or workspace['visible']:
+                return False  # another workspace shows up on its old output
+            workspace['output'] = output
+            workspace['rect'] = current.get('rect', workspace['rect'])
+            return True
+        return False
+    
+    def update(self, event_type, event):
+        """
+        Applies the given event or fetches everything again if it can't be
+        applied, then calls the callback.
+        """
+        with self.lock:
+            self.events += 1
+            applied = self.apply(event_type, event)
+            if applied:
+                self.applied += 1
+                self.publish()
+        if not applied:
+            self.resync()
+        if self.callback:
+            try:
+                self.callback(self)
+            except Exception:
+                traceback.print_exc()
+    
+    def listen(self):
+        """
+        Runs the event listener loop until the state is closed.
+        """
+        try:
+            while self.listening:
+                message = self.event_socket.receive_message()
+                if message is None:
+                    continue
+                msg_type, event = message
+                event_type = event_type_of(msg_type)
+                if event_type:
+                    self.update(event_type, event)
+        except socket.error:
+            pass
+        self.listening = False
+    
+    def close(self):
+        """
+        Stops the event listener.
+        """
+        self.listening = False
+        self.event_socket.close()
+
+
+class Daemon(object):
+    """
+    Resident process for scripts run on every keypress (e.g. via "bindsym
+    ... exec"). It keeps warm connections to i3-wm and a cached tree, and
+    serves requests on a socket of its own (see i3.Client and the i3client
+    module), so a script only pays for connecting to it. Started with
+    "python -m i3 --daemon", or:
+      daemon = i3.Daemon()
+      daemon.serve_forever()
+    Requests use i3-ipc framing with the 'i3-py' magic string and a JSON
+    object as payload, either {"type": <msg_type>, "message": <message>},
+    forwarded to i3-wm, or {"run": "module:function", "args": [...]}, which
+    calls the function inside the daemon (the module is imported once).
+    Replies are {"result": ...} or {"error": "..."}.
+    Optional arguments:
+    - path of the daemon's socket, "i3.get_daemon_socket_path()" if not
+      given
+    - socket for talking to i3-wm. Default pool is used if not given.
+    - event_socket for the tree cache's events, see i3.TreeCache
+    """
+    magic_string = 'i3-py'
+    
+    def __init__(self, path=None, socket=None, event_socket=None):
+        self.path = path or get_daemon_socket_path()
+        self.server = self.bind()
+        self.socket = socket or default_pool()
+        self.cache = TreeCache(max_age=None, socket=self.socket,
+                               event_socket=event_socket)
+        tree_cache(self.cache)  # scripts run by the daemon use it too
+        self.serving = False
+    
+    def bind(self):
+        """
+        Returns the daemon's listening socket, only accessible by the user.
+        Raises i3Exception if another daemon is listening on the path.
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error as error:
+                if error.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(self.path)  # left behind by a daemon that died
+            else:
+                raise i3Exception('A daemon is running at %s' % self.path)
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)  # never accessible by others, not even briefly
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        return server
+    
+    def serve_forever(self):
+        """
+        Accepts clients until the daemon is closed, each one is served on a
+        thread of its own.
+        """
+        self.serving = True
+        while self.serving:
+            try:
+                connection, _ = self.server.accept()
+            except socket.error:
+                break
+            thread = threading.Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+    
+    def serve(self, connection):
+        """
+        Serves the requests of a single client.
+        """
+        channel = Socket(lazy=True, magic_string=self.magic_string)
+        channel.attach(connection)
+        connection.settimeout(None)  # clients may stay idle for long
+        try:
+            while True:
+                message = channel.receive_message()
+                if message is None:
+                    continue
+                channel.send(0, self.execute(message[1], channel.codec))
+        except socket.error:
+            pass
+        finally:
+            channel.close()
+    
+    def execute(self, request, codec):
+        """
+        Executes the given request, returns the reply encoded with the given
+        codec. Failures, including results the codec can't encode, are
+        replied as errors.
+        """
+        try:
+            if 'run' in request:
+                module, name = request['run'].split(':', 1)
+                function = getattr(importlib.import_module(module), name)
+                result = function(*request.get('args', []))
+            else:
+                msg_type = request.get('type', 'command')
+                message = request.get('message', '')
+                if not message and parse_msg_type(msg_type) == MSG_TYPES.index('get_tree'):
+                    result = self.cache.get()
+                else:
+                    result = self.socket.get(msg_type, message)
+            return codec.dumps({'result': result})
+        except Exception as error:
+            return codec.dumps({'error': '%s: %s' % (type(error).__name__, error)})
+    
+    def close(self):
+        """
+        Stops serving and removes the daemon's socket.
+        """
+        self.serving = False
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)  # wakes up accept
+        except socket.error:
+            pass
+        self.server.close()
+        self.cache.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Client(object):
+    """
+    Client of an i3.Daemon. Example:
+      client = i3.Client()
+      client.msg('command', 'focus left')
+      client.run('myscripts:toggle', 'scratchpad')
+    Raises i3.MessageError with the error message if a request fails.
+    Optional arguments:
+    - path of the daemon's socket, "i3.get_daemon_socket_path()" if not
+      given
+    - timeout in seconds
+    """
+    timeout = 5  # in seconds, scripts run by the daemon may take a while
+    
+    def __init__(self, path=None, timeout=None):
+        if timeout:
+            self.timeout = timeout
+        path = path or get_daemon_socket_path()
+        self.socket = Socket(path, self.timeout, magic_string=Daemon.magic_string)
+    
+    def request(self, request):
+        """
+        Sends the given request to the daemon, returns the result.
+        """
+        reply = self.socket.get(0, self.socket.codec.dumps(request))
+        if reply is None:
+            raise MessageError('No reply from the daemon')
+        if 'error' in reply:
+            raise MessageError(reply['error'])
+        return reply['result']
+    
+    def msg(self, type, message=''):
+        """
+        Same as "i3.msg", through the daemon.
+        """
+        return self.request({'type': type, 'message': message})
+    
+    def run(self, function, *args):
+        """
+        Calls the given "module:function" inside the daemon with the given
+        (JSON serializable) args, returns its result.
+        """
+        return self.request({'run': function, 'args': list(args)})
+    
+    def close(self):
+        """
+        Closes the connection to the daemon.
+        """
+        self.socket.close()
+
+
+class SnapshotPublisher(object):
+    """
+    Publishes the tree into a memory-mapped file, for any number of reader
+    processes (see i3.SnapshotReader) which then get it without asking
+    i3-wm or decoding JSON. A background thread listens to window,
+    workspace and output events on its own socket and publishes a new
+    snapshot after each burst of them.
+    The file starts with a header of a magic string, the format version,
+    the data length and a sequence number, which is odd while a snapshot is
+    being written (a seqlock). The data is a table of fixed-size node
+    records in breadth-first order, so that the children of a node are
+    next to each other, followed by a table of UTF-8 strings, each stored
+    once. The most used keys are stored in the records, any other keys of a
+    node as a JSON object in the string table.
+    The file is kept on close, so that readers keep working across restarts
+    of the publisher. Only one publisher should write to a file at a time.
+    Optional arguments:
+    - path of the snapshot file, "i3.get_snapshot_path()" if not given
+    - socket for fetching the tree. Default pool is used if not given.
+    - event_socket for listening to events. A new socket is created if not
+      given.
+    """
+    magic = b'i3-py-tr'
+    version = 1
+    header = struct.Struct('<8sIIQ')  # magic, version, length, sequence
+    section = struct.Struct('<I')  # node count
+    # id, window, parent, first child, node count, floating node count,
+    # present and null field bits, focused, urgent, rect, then the (offset,
+    # length) of the name, type, layout and other keys in the string table
+    record = struct.Struct('<qqiIIIHHBBxxiiiiIIIIIIII')
+    fields = ['id', 'window', 'nodes', 'floating_nodes', 'focused', 'urgent',
+              'rect', 'name', 'type', 'layout']
+    bits = dict((field, 1 << index) for index, field in enumerate(fields))
+    event_types = ['window', 'workspace', 'output']
+    capacity = 64 * 1024  # initial size of the file in bytes
+    debounce = 0.01  # in seconds
+    max_latency = 0.1  # in seconds
+    
+    def __init__(self, path=None, socket=None, event_socket=None):
+        self.path = path or get_snapshot_path()
+        self.socket = socket
+        self.lock = threading.Lock()
+        self.published = 0
+        # Snapshot file, continuing the sequence of a previous publisher
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+        self.fd = os.open(self.path, flags, 0o600)
+        status = os.fstat(self.fd)
+        if status.st_uid != os.getuid():
+            os.close(self.fd)
+            raise OSError(errno.EPERM, 'Snapshot file is not ours', self.path)
+        size = status.st_size
+        if size < self.capacity:
+            os.ftruncate(self.fd, self.capacity)
+            size = self.capacity
+        self.map = mmap.mmap(self.fd, size)
+        magic, version, length, sequence = self.header.unpack_from(self.map)
+        if magic != self.magic or version != self.version:
+            sequence = 0
+        self.sequence = sequence + (sequence & 1)
+        # Event listener
+        if not event_socket:
+            event_socket = Socket()
+        self.event_socket = event_socket
+        event_types = self.event_socket.codec.dumps(self.event_types)
+        self.event_socket.get('subscribe', event_types)
+        self.listening = True
+        self.thread = threading.Thread(target=self.listen)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def fits(self, key, value):
+        """
+        Returns True if the given value of the given key can be stored in a
+        node record.
+        """
+        if key in ('nodes', 'floating_nodes'):
+            return (isinstance(value, list) and
+                    all(isinstance(node, (dict, Node)) for node in value))
+        if value is None:
+            return key != 'rect'
+        if key in ('focused', 'urgent'):
+            return isinstance(value, bool)
+        if key in ('id', 'window'):
+            return (isinstance(value, int) and not isinstance(value, bool) and
+                    -1 << 63 <= value < 1 << 63)
+        if key == 'rect':
+            return (isinstance(value, (dict, Rect)) and
+                    sorted(value.keys()) == ['height', 'width', 'x', 'y'] and
+                    all(isinstance(value[name], int) and -1 << 31 <= value[name] < 1 << 31
+                        for name in ('x', 'y', 'width', 'height')))
+        return isinstance(value, TEXT_TYPES)
+    
+    def encode(self, tree):
+        """
+        Returns the given tree in the snapshot format, without the header.
+        """
+        nodes = [tree]
+        parents = [-1]
+        records = []
+        table = bytearray()
+        strings = {}  # encoded string -> (offset, length) in the table
+        def string(text):
+            data = text.encode('utf-8')
+            if data not in strings:
+                strings[data] = (len(table), len(data))
+                table.extend(data)
+            return strings[data]
+        bits = self.bits
+        index = 0
+        while index < len(nodes):
+            node = nodes[index]
+            present = null = 0
+            extra = {}
+            for key, value in node.items():
+                if key in bits and self.fits(key, value):
+                    present |= bits[key]
+                    if value is None:
+                        null |= bits[key]
+                elif isinstance(value, Rect):
+                    extra[key] = value.to_dict()  # not a list
+                else:
+                    extra[key] = value
+            native = present & ~null
+            value = lambda key, default: node[key] if native & bits[key] else default
+            children = value('nodes', [])
+            floating = value('floating_nodes', [])
+            first = len(nodes)
+            nodes.extend(children)
+            nodes.extend(floating)
+            parents.extend([index] * (len(children) + len(floating)))
+            rect = value('rect', {})
+            references = []
+            for key in ('name', 'type', 'layout'):
+                references.extend(string(value(key, u'')))
+            if extra:
+                references.extend(string(json.dumps(extra, separators=(',', ':'))))
+            else:
+                references.extend((0, 0))
+            records.append(self.record.pack(
+                value('id', 0), value('window', 0), parents[index], first,
+                len(children), len(floating), present, null,
+                value('focused', False), value('urgent', False),
+                rect.get('x', 0), rect.get('y', 0), rect.get('width', 0),
+                rect.get('height', 0), *references))
+            index += 1
+        return self.section.pack(len(nodes)) + b''.join(records) + bytes(table)
+    
+    def publish(self, tree):
+        """
+        Writes the given tree as the new snapshot.
+        """
+        data = self.encode(tree)
+        end = self.header.size + len(data)
+        with self.lock:
+            if self.map is None:
+                return  # closed
+            # Readers retry while the sequence number is odd
+            self.sequence += 1
+            self.header.pack_into(self.map, 0, self.magic, self.version, 0,
+                                  self.sequence)
+            if end > len(self.map):
+                size = max(end, len(self.map) * 2)
+                self.map.close()
+                os.ftruncate(self.fd, size)
+                self.map = mmap.mmap(self.fd, size)
+            self.map[self.header.size:end] = data
+            self.sequence += 1
+            self.header.pack_into(self.map, 0, self.magic, self.version,
+                                  len(data), self.sequence)
+            self.published += 1
+    
+    def update(self):
+        """
+        Fetches the tree and publishes it.
+        """
+        tree = (self.socket or default_pool()).get('get_tree')
+        if tree is not None:
+            self.publish(tree)
+    
+    def listen(self):
+        """
+        Publishes the tree, then a new one after each burst of events (see
+        i3.Subscription for debounce and max_latency), until the publisher
+        is closed.
+        """
+        poll = self.event_socket.poll
+        try:
+            self.update()
+            while self.listening:
+                if poll(self.event_socket.timeout) is None:
+                    continue
+                deadline = time.time() + self.max_latency
+                while poll(min(self.debounce, deadline - time.time())) is not None:
+                    pass
+                self.update()
+        except socket.error:
+            pass
+        self.listening = False
+    
+    def close(self):
+        """
+        Stops the event listener and closes the snapshot file.
+        """
+        self.listening = False
         self.event_socket.close()
-        if self.data_socket is not default_socket():
-            self.data_socket.close()
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                os.close(self.fd)
+                self.map = None
+
+
+class SnapshotReader(object):
+    """
+    Reads the trees published by an i3.SnapshotPublisher, usually running
+    in another process. Reading a tree copies the snapshot out of the
+    mapped file and nothing else: nodes are decoded when they're accessed.
+    Example:
+      reader = i3.SnapshotReader()
+      tree = reader.tree()  # None if nothing has been published yet
+      focused = i3.filter(tree, nodes=[], focused=True)
+    "reader.tree()" only reads the file again once a new snapshot has been
+    published, "reader.fresh()" tells if that's the case.
+    Optional arguments:
+    - path of the snapshot file, "i3.get_snapshot_path()" if not given
+    - timeout in seconds, for waiting on a snapshot that's being written
+    """
+    timeout = 1  # in seconds
+    
+    def __init__(self, path=None, timeout=None):
+        self.path = path or get_snapshot_path()
+        if timeout:
+            self.timeout = timeout
+        self.file = open(self.path, 'rb')
+        self.map = None
+        self.snapshot = None  # last one read
+    
+    def remap(self):
+        """
+        Maps the whole file, which grows along with the snapshots. Returns
+        False if it isn't big enough for the header yet.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        size = os.fstat(self.file.fileno()).st_size
+        if size < SnapshotPublisher.header.size:
+            return False
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        return True
+    
+    @property
+    def sequence(self):
+        """
+        Sequence number of the current snapshot, 0 if none has been
+        published yet and odd while one is being written.
+        """
+        if self.map is None and not self.remap():
+            return 0
+        return SnapshotPublisher.header.unpack_from(self.map)[3]
+    
+    def fresh(self):
+        """
+        Returns True if no snapshot has been published since the last one
+        read.
+        """
+        return self.snapshot is not None and self.snapshot.sequence == self.sequence
+    
+    def read(self):
+        """
+        Returns the current snapshot as an i3.Snapshot, None if nothing has
+        been published yet. Raises i3Exception if it's still being written
+        after timeout seconds, or if the file isn't a snapshot file.
+        """
+        header = SnapshotPublisher.header
+        deadline = time.time() + self.timeout
+        while True:
+            sequence = self.sequence
+            if not sequence:
+                return None
+            if not sequence & 1:
+                magic, version, length, sequence = header.unpack_from(self.map)
+                if (magic, version) != (SnapshotPublisher.magic, SnapshotPublisher.version):
+                    raise i3Exception('Not a snapshot file: %s' % self.path)
+                end = header.size + length
+                if end > len(self.map):
+                    self.remap()
+                    continue
+                data = self.map[header.size:end]
+                # Consistent unless the publisher started writing meanwhile
+                if header.unpack_from(self.map)[3] == sequence:
+                    return Snapshot(data, sequence)
+            if time.time() > deadline:
+                raise i3Exception('Snapshot still being written: %s' % self.path)
+            time.sleep(0.001)
+    
+    def tree(self):
+        """
+        Returns the root i3.SnapshotNode of the current snapshot, reading it
+        only if it changed since the last call. None if nothing has been
+        published yet.
+        """
+        if not self.fresh():
+            snapshot = self.read()
+            if snapshot is not None:
+                self.snapshot = snapshot
+        if self.snapshot is None:
+            return None
+        return self.snapshot.root
+    
+    def close(self):
+        """
+        Closes the snapshot file. Nodes already read stay usable.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+
+class Snapshot(object):
+    """
+    Tree snapshot read by an i3.SnapshotReader, as the data copied out of
+    the snapshot file. Nodes are created on first access and kept, so the
+    same container is always the same i3.SnapshotNode.
+    """
+    def __init__(self, data, sequence):
+        self.data = data
+        self.sequence = sequence
+        self.count, = SnapshotPublisher.section.unpack_from(data)
+        self.strings = (SnapshotPublisher.section.size +
+                        self.count * SnapshotPublisher.record.size)
+        self.nodes = {}
+    
+    @property
+    def root(self):
+        """
+        Root node of the tree.
+        """
+        return self.node(0)
+    
+    def node(self, index):
+        """
+        Returns the node with the given index (in breadth-first order).
+        """
+        node = self.nodes.get(index)
+        if node is None:
+            node = self.nodes[index] = SnapshotNode(self, index)
+        return node
+    
+    def string(self, offset, length):
+        """
+        Returns the string at the given offset of the string table.
+        """
+        start = self.strings + offset
+        return self.data[start:start + length].decode('utf-8')
+
+
+class SnapshotNode(object):
+    """
+    Read-only node of a tree snapshot. It's used the same way as a node of
+    "i3.msg('get_tree')", so it works with i3.filter, i3.Query and i3.Tree.
+    Keys stored in the node record are decoded on each access, the other
+    ones (e.g. marks) are decoded from JSON on first access.
+    "node.to_dict()" returns a copy of the node and its children as dicts.
+    """
+    __slots__ = ['snapshot', 'index', 'record', 'extra']
+    strings = {'name': 14, 'type': 16, 'layout': 18}  # record positions
+    
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+        offset = SnapshotPublisher.section.size + index * SnapshotPublisher.record.size
+        self.record = SnapshotPublisher.record.unpack_from(snapshot.data, offset)
+        self.extra = None
+    
+    def __getitem__(self, key):
+        bit = SnapshotPublisher.bits.get(key, 0)
+        if self.record[6] & bit:
+            if self.record[7] & bit:
+                return None
+            return self.value(key)
+        return self.extras()[key]
+    
+    def __contains__(self, key):
+        return bool(self.record[6] & SnapshotPublisher.bits.get(key, 0)) or key in self.extras()
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __repr__(self):
+        return '<i3.SnapshotNode %s>' % self.get('id')
+    
+    def get(self, key, default=None):
+        """
+        Returns the value of the given key, or default if there's none.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        """
+        Returns a list of the node's keys.
+        """
+        present = self.record[6]
+        keys = [key for key in SnapshotPublisher.fields
+                if present & SnapshotPublisher.bits[key]]
+        return keys + list(self.extras())
+    
+    def items(self):
+        """
+        Returns a list of the node's (key, value) pairs.
+        """
+        return [(key, self[key]) for key in self.keys()]
+    
+    def value(self, key):
+        """
+        Returns the value of the given key from the node record.
+        """
+        record = self.record
+        if key in self.strings:
+            position = self.strings[key]
+            return self.snapshot.string(record[position], record[position + 1])
+        if key == 'id':
+            return record[0]
+        if key == 'window':
+            return record[1]
+        if key == 'focused':
+            return bool(record[8])
+        if key == 'urgent':
+            return bool(record[9])
+        if key == 'rect':
+            x, y, width, height = record[10:14]
+            return {'x': x, 'y': y, 'width': width, 'height': height}
+        first, count = record[3], record[4]
+        if key == 'floating_nodes':
+            first, count = first + count, record[5]
+        node = self.snapshot.node
+        return [node(index) for index in range(first, first + count)]
+    
+    def extras(self):
+        """
+        Returns a dict of the keys that aren't stored in the node record.
+        """
+        if self.extra is None:
+            offset, length = self.record[20:22]
+            if length:
+                self.extra = json.loads(self.snapshot.string(offset, length))
+            else:
+                self.extra = {}
+        return self.extra
+    
+    def parent(self):
+        """
+        Returns the parent node, None for the root.
+        """
+        if self.record[2] < 0:
+            return None
+        return self.snapshot.node(self.record[2])
+    
+    def to_dict(self):
+        """
+        Returns the node and its children as dicts, like they come from
+        "i3.msg('get_tree')".
+        """
+        present = self.record[6] & ~self.record[7]
+        result = {}
+        for key, value in self.items():
+            if key in ('nodes', 'floating_nodes') and present & SnapshotPublisher.bits[key]:
+                value = [node.to_dict() for node in value]
+            result[key] = value
+        return result
 
 
 def __call_cmd__(cmd):
@@ -374,25 +3306,117 @@ def default_socket(socket=None):
     """
     Returns i3.Socket object, which was initiliazed once with default values
     if no argument is given.
-    Otherwise sets the default socket to the given socket.
+    Otherwise sets the default socket to the given socket. Requests of the
+    module go through it from then on, one at a time: the default pool is
+    closed and replaced by one holding just the given socket, so objects
+    given the old pool (e.g. subscriptions) can't use it anymore. Set the
+    default socket before creating them, or set the default pool instead
+    (see "i3.default_pool").
     """
-    global __socket__
+    global __socket__, __pool__
     if socket and isinstance(socket, Socket):
         __socket__ = socket
+        if __pool__:
+            __pool__.close()  # its idle sockets would be left open
+        __pool__ = SocketPool(1, socket.path, socket.timeout, sockets=[socket])
     elif not __socket__:
-        __socket__ = Socket()
+        __socket__ = Socket(lazy=True)
     return __socket__
 
 
+__codec__ = next(iter(CODECS.values()))
+def default_codec(codec=None):
+    """
+    Returns the default JSON codec of sockets, the fastest one installed
+    unless set otherwise. Sets it to the given codec (an i3.Codec or the
+    name of one in "i3.CODECS") if an argument is given; sockets created
+    before keep theirs.
+    """
+    global __codec__
+    if codec:
+        __codec__ = get_codec(codec)
+    return __codec__
+
+
+def get_codec(codec=None):
+    """
+    Returns the given codec, the one in "i3.CODECS" with the given name or
+    the default codec if not given. Raises i3Exception for unknown names.
+    """
+    if not codec:
+        return __codec__
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in CODECS:
+        raise i3Exception('Unknown JSON codec: %s' % codec)
+    return CODECS[codec]
+
+
+__pool__ = None
+def default_pool(pool=None):
+    """
+    Returns i3.SocketPool object, which was initialized once with default
+    values if no argument is given. It serves "i3.msg" and the generated
+    functions, so they can be used from any number of threads.
+    Otherwise sets the default pool to the given pool.
+    """
+    global __pool__
+    if pool and isinstance(pool, SocketPool):
+        __pool__ = pool
+    elif not __pool__:
+        __pool__ = SocketPool()
+    return __pool__
+
+
+__tree_cache__ = None
+def tree_cache(cache=None):
+    """
+    Returns the installed i3.TreeCache object, None if there isn't one.
+    Installs the given cache if an argument is given.
+    """
+    global __tree_cache__
+    if cache and isinstance(cache, TreeCache):
+        __tree_cache__ = cache
+    return __tree_cache__
+
+
+__dispatcher__ = None
+def default_dispatcher(dispatcher=None):
+    """
+    Returns i3.EventDispatcher object, which was initialized once with
+    default values if no argument is given.
+    Otherwise sets the default dispatcher to the given dispatcher.
+    """
+    global __dispatcher__
+    if dispatcher and isinstance(dispatcher, EventDispatcher):
+        __dispatcher__ = dispatcher
+    elif not __dispatcher__:
+        __dispatcher__ = EventDispatcher()
+    return __dispatcher__
+
+
 def msg(type, message=''):
     """
     Takes a message type and a message itself.
     Talks to the i3 via socket and returns the response from the socket.
+    Trees are served from the installed i3.TreeCache if there is one.
     """
-    response = default_socket().get(type, message)
+    if (__tree_cache__ and not message and
+            parse_msg_type(type) == MSG_TYPES.index('get_tree')):
+        return __tree_cache__.get()
+    response = default_pool().get(type, message)
     return response
 
 
+def msg_many(requests):
+    """
+    Takes a list of (message type, message) tuples (or just message types).
+    Sends all of them to i3 at once via the default pool and returns the
+    responses in the same order.
+    """
+    return default_pool().get_many(requests)
+
+
 def __function__(type, message='', *args, **crit):
     """
     Accepts a message type, a message. Takes optional args and keyword
@@ -401,11 +3425,9 @@ def __function__(type, message='', *args, **crit):
     If message type was 'command', the function returns success value.
     """
     def function(*args2, **crit2):
-        msg_full = ' '.join([message] + list(args)  + list(args2))
         criteria = dict(crit)
         criteria.update(crit2)
-        if criteria:
-            msg_full = '%s %s' % (container(**criteria), msg_full)
+        msg_full = __compose__(message, list(args) + list(args2), criteria)
         response = msg(type, msg_full)
         response = success(response)
         if isinstance(response, i3Exception):
@@ -416,6 +3438,100 @@ def __function__(type, message='', *args, **crit):
     return function
 
 
+def __compose__(message, args, criteria):
+    """
+    Joins a message and its arguments, prefixed by the container criteria.
+    """
+    msg_full = ' '.join([message] + list(args))
+    if criteria:
+        msg_full = '%s %s' % (container(**criteria), msg_full)
+    return msg_full
+
+
+def batch(socket=None, max_payload=None):
+    """
+    Returns a new i3.Batch, for sending several commands as one message:
+      with i3.batch() as batch:
+          batch.workspace('2')
+          batch.layout('tabbed')
+    """
+    return Batch(socket, max_payload)
+
+
+def events(*event_types, **options):
+    """
+    Returns an i3.EventStream of the given event types, yielding
+    (event_type, event) tuples on the calling thread:
+      for event_type, event in i3.events('workspace', timeout=10):
+          print(event['change'])
+    Optional keyword arguments:
+    - timeout in seconds to wait for each event, forever if None
+    - event_socket to subscribe, a new socket by default
+    """
+    return EventStream(event_types, options.get('timeout'),
+                       options.get('event_socket'))
+
+
+def wait_for(event_type, predicate=None, timeout=None, action=None,
+             settle=False, event_socket=None):
+    """
+    Waits for an event of the given type for which predicate(event) is true
+    and returns it, None on timeout. Example:
+      i3.wait_for('window', lambda event: event['change'] == 'close',
+                  timeout=2, action=i3.kill)
+    Optional arguments:
+    - predicate, any event of the type matches if not given
+    - timeout in seconds, forever if None
+    - action, a function called once subscribed, so that the event it
+      causes can't be missed
+    - settle, if True gives up as soon as i3-wm has handled the action
+      (see "EventStream.barrier") instead of waiting out the timeout. Only
+      for actions whose events i3-wm sends right away (e.g. switching
+      workspaces), not for windows opening or closing.
+    - event_socket to subscribe, a new socket by default
+    """
+    with EventStream([event_type], event_socket=event_socket) as stream:
+        if action:
+            action()
+        if not settle:
+            return stream.wait_for(predicate, timeout)
+        for message in stream.barrier(timeout) or []:
+            if not predicate or predicate(message[1]):
+                return message[1]
+        return None
+
+
+def exec_and_wait(cmd, match=None, timeout=10, event_socket=None):
+    """
+    Runs the given command (like "i3.exec(cmd)") and waits for its window
+    to appear. Returns the new window's container, None on timeout.
+    Optional arguments:
+    - match, a dict of values the container (or its window_properties) must
+      have, e.g. {'class': 'URxvt'}, or a function that takes the container
+      and returns True if it's the one. Any new window matches if not given.
+    - timeout in seconds
+    - event_socket to subscribe (and send the command over), a new socket
+      by default
+    """
+    def predicate(event):
+        if event.get('change') != 'new':
+            return False
+        con = event.get('container') or {}
+        if callable(match):
+            return match(con)
+        properties = con.get('window_properties') or {}
+        for key, value in (match or {}).items():
+            if con.get(key, properties.get(key)) != value:
+                return False
+        return True
+    with EventStream(['window'], event_socket=event_socket) as stream:
+        response = success(stream.event_socket.get('command', 'exec ' + cmd))
+        if isinstance(response, i3Exception):
+            raise response
+        event = stream.wait_for(predicate, timeout)
+    return event and event['container']
+
+
 def subscribe(event_type, event=None, callback=None):
     """
     Accepts an event_type and event itself.
@@ -428,8 +3544,7 @@ def subscribe(event_type, event=None, callback=None):
             if data:
                 print('data:\n', data)
     
-    socket = default_socket()
-    subscription = Subscription(callback, event_type, event, data_socket=socket)
+    subscription = Subscription(callback, event_type, event, data_socket=default_pool())
     try:
         while True:
             time.sleep(1)
@@ -439,13 +3554,211 @@ def subscribe(event_type, event=None, callback=None):
         subscription.close()
 
 
+def get_daemon_socket_path():
+    """
+    Returns the path of the i3.Daemon socket: I3PY_SOCK environment
+    variable if set, otherwise a per-user path in XDG_RUNTIME_DIR (or the
+    temporary directory).
+    """
+    return os.environ.get('I3PY_SOCK') or __runtime_path__('sock')
+
+
+def get_snapshot_path():
+    """
+    Returns the path of the i3.SnapshotPublisher file: I3PY_SNAPSHOT
+    environment variable if set, otherwise a per-user path next to the
+    daemon's socket.
+    """
+    return os.environ.get('I3PY_SNAPSHOT') or __runtime_path__('tree')
+
+
+def __runtime_path__(extension):
+    """
+    Returns a per-user path with the given extension in XDG_RUNTIME_DIR, or
+    in a private directory of the user in the temporary directory. Raises
+    OSError if that directory is someone else's or others can access it.
+    """
+    uid = os.getuid()
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(os.environ.get('TMPDIR') or '/tmp',
+                                 'i3-py-%d' % uid)
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        status = os.lstat(directory)  # symlinks aren't followed
+        if (not stat.S_ISDIR(status.st_mode) or status.st_uid != uid or
+                status.st_mode & 0o077):
+            raise OSError(errno.EPERM, 'Not a private directory', directory)
+    return os.path.join(directory, 'i3-py-%d.%s' % (uid, extension))
+
+
+__socket_path__ = None
 def get_socket_path():
     """
-    Gets the socket path via i3 command.
+    Gets the socket path. Tries the I3SOCK environment variable first, then
+    the I3_SOCKET_PATH property of the X root window (read straight from the
+    X server) and finally the "i3 --get-socketpath" command.
+    The path is cached for the rest of the process, a socket that fails to
+    connect to it drops it from the cache. Returns an empty string if the
+    path can't be found.
+    """
+    global __socket_path__
+    if not __socket_path__:
+        for resolve in [__env_socket_path__, __x11_socket_path__,
+                        __cmd_socket_path__]:
+            path = resolve()
+            if path:
+                __socket_path__ = path
+                break
+        else:
+            return ''
+    return __socket_path__
+
+
+def __env_socket_path__():
+    """
+    Returns the socket path from the I3SOCK environment variable.
+    """
+    return os.environ.get('I3SOCK')
+
+
+def __cmd_socket_path__():
+    """
+    Returns the socket path via i3 command.
     """
     cmd = ['i3', '--get-socketpath']
-    output = __call_cmd__(cmd)
-    return output
+    try:
+        return __call_cmd__(cmd)
+    except OSError:  # i3 isn't on PATH
+        return None
+
+
+def __x11_socket_path__(display=None):
+    """
+    Returns the I3_SOCKET_PATH property of the X root window. Talks to the X
+    server over its local socket directly, so neither Xlib nor a subprocess
+    is needed. Returns None if anything goes wrong.
+    """
+    display = display or os.environ.get('DISPLAY', '')
+    match = re.match(r'^(?:unix)?:(\d+)(?:\.(\d+))?$', display)
+    if not match:
+        return None
+    number, screen = match.group(1), int(match.group(2) or 0)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(1)
+    try:
+        conn.connect('/tmp/.X11-unix/X%s' % number)
+        root = __x11_setup__(conn, number, screen)
+        if root is None:
+            return None
+        # InternAtom, only if it exists
+        name = b'I3_SOCKET_PATH'
+        conn.sendall(struct.pack('<BBHH2x', 16, 1, 2 + __x11_pad__(len(name)) // 4,
+                                 len(name)) + __x11_padded__(name))
+        reply = __recv_exact__(conn, 32)
+        atom = struct.unpack_from('<I', reply, 8)[0]
+        if reply[0:1] != b'\x01' or not atom:
+            return None
+        # GetProperty of any type, up to 4 KB
+        conn.sendall(struct.pack('<BBHIIIII', 20, 0, 6, root, atom, 0, 0, 1024))
+        reply = __recv_exact__(conn, 32)
+        if reply[0:1] != b'\x01':
+            return None
+        length, = struct.unpack_from('<I', reply, 4)
+        format = bytearray(reply[1:2])[0]
+        value_length, = struct.unpack_from('<I', reply, 16)
+        value = __recv_exact__(conn, length * 4)[:value_length * format // 8]
+        return value.decode('utf-8').rstrip('\x00') or None
+    except (socket.error, struct.error, IndexError, UnicodeDecodeError):
+        return None
+    finally:
+        conn.close()
+
+
+def __x11_setup__(conn, number, screen):
+    """
+    Sets up an X11 connection, authorized with a matching Xauthority cookie
+    if there is one. Returns the root window id of the given screen.
+    """
+    auth_name, auth_data = __xauth_cookie__(number)
+    conn.sendall(struct.pack('<BxHHHH2x', ord('l'), 11, 0, len(auth_name),
+                             len(auth_data)) +
+                 __x11_padded__(auth_name) + __x11_padded__(auth_data))
+    header = __recv_exact__(conn, 8)
+    body = __recv_exact__(conn, struct.unpack_from('<H', header, 6)[0] * 4)
+    if header[0:1] != b'\x01':  # failed or needs further authentication
+        return None
+    vendor_length, = struct.unpack_from('<H', body, 16)
+    screens, formats = bytearray(body[20:22])
+    if screen >= screens:
+        return None
+    offset = 32 + __x11_pad__(vendor_length) + 8 * formats
+    for index in range(screen):
+        depths = bytearray(body[offset + 39:offset + 40])[0]
+        offset += 40
+        for depth in range(depths):
+            visuals, = struct.unpack_from('<H', body, offset + 2)
+            offset += 8 + 24 * visuals
+    return struct.unpack_from('<I', body, offset)[0]
+
+
+def __xauth_cookie__(number):
+    """
+    Returns an (auth name, auth data) tuple from the Xauthority file for the
+    given local display number. Both are empty if there's no such entry.
+    """
+    path = os.environ.get('XAUTHORITY') or os.path.expanduser('~/.Xauthority')
+    hostname = socket.gethostname().encode('utf-8')
+    number = number.encode('utf-8')
+    try:
+        with open(path, 'rb') as xauth:
+            data = xauth.read()
+    except (IOError, OSError):
+        return b'', b''
+    offset = 0
+    while offset + 2 <= len(data):
+        family, = struct.unpack_from('>H', data, offset)
+        offset += 2
+        fields = []
+        for field in range(4):  # address, display number, name, data
+            length, = struct.unpack_from('>H', data, offset)
+            fields.append(data[offset + 2:offset + 2 + length])
+            offset += 2 + length
+        address, display, name, cookie = fields
+        local = family == 65535 or (family == 256 and address == hostname)
+        if local and display in (number, b'') and name == b'MIT-MAGIC-COOKIE-1':
+            return name, cookie
+    return b'', b''
+
+
+def __x11_pad__(length):
+    """
+    Returns the length rounded up to a multiple of 4, as X11 pads data.
+    """
+    return (length + 3) & ~3
+
+
+def __x11_padded__(data):
+    """
+    Returns the byte string padded to a multiple of 4 bytes.
+    """
+    return data + b'\x00' * (__x11_pad__(len(data)) - len(data))
+
+
+def __recv_exact__(conn, size):
+    """
+    Receives exactly size bytes from the given socket.
+    """
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise socket.error(errno.ECONNRESET, 'Connection closed')
+        data += chunk
+    return data
 
 
 def success(response):
@@ -481,16 +3794,14 @@ def parent(con_id, tree=None):
     Searches for a parent of a node/container, given the container id.
     Returns None if no container with given id exists (or if the
     container is already a root node).
+    The tree can also be an i3.Tree, which makes this a single lookup.
+    Without a tree, the installed i3.TreeCache is used if there is one.
     """
-    def has_child(node):
-        for child in node['nodes']:
-            if child['id'] == con_id:
-                return True
-        return False
-    parents = filter(tree, has_child)
-    if not parents or len(parents) > 1:
-        return None
-    return parents[0]
+    if tree is None and __tree_cache__:
+        tree = __tree_cache__.index()
+    if not isinstance(tree, Tree):
+        tree = Tree(tree)
+    return tree.parent(con_id)
 
  
 def filter(tree=None, function=None, **conditions):
@@ -502,30 +3813,321 @@ def filter(tree=None, function=None, **conditions):
     only one item that matches.
     The user function should take a single node. The function doesn't have
     to do any dict key or index checking (this is handled by i3.filter
-    internally).
+    internally). Conditions are ignored if a function is given.
+    See i3.Query for repeated or early-terminating searches.
     """
-    if tree is None:
-        tree = msg('get_tree')
-    elif isinstance(tree, list):
-        tree = {'list': tree}
     if function:
-        try:
-            if function(tree):
-                return [tree]
-        except (KeyError, IndexError):
-            pass
+        conditions = {}
+    return Query(function, **conditions).all(tree)
+
+
+def iter_filter(tree=None, function=None, children=None, **conditions):
+    """
+    Same as "i3.filter", but yields matched items as they're found. Takes
+    an optional list of child lists to search (see i3.Query).
+    """
+    if function:
+        conditions = {}
+    return Query(function, children, **conditions).iter(tree)
+
+
+def iter_tree(tree=None, fields=None, prune=None):
+    """
+    Parses a get_tree reply incrementally. Yields nodes parents first, as
+    soon as the keys before their children are read; the rest of a node
+    (its children, focus...) is filled in as the iteration goes on, and
+    stopping the iteration stops the parsing. Example, the focused window
+    with nothing but its id and name:
+      fields = ['id', 'name', 'focused']
+      window = next(node for node in i3.iter_tree(fields=fields) if node['focused'])
+    Optional arguments:
+    - tree, the reply as a byte string or string. Fetched if not given.
+    - fields, keys to keep. The values of other keys are skipped without
+      being decoded, child lists not in fields are still parsed but not
+      kept.
+    - prune, takes a node (with the keys before its children, only those
+      in fields if given) and returns True to leave out the node and its
+      subtree, which is skipped without being decoded. For example, to
+      leave out the scratchpad:
+        prune = lambda node: node['name'] == '__i3'
+    Raises ValueError if the reply isn't valid JSON.
+    """
+    if tree is None:
+        tree = default_pool().get_raw('get_tree')
+        if tree is None:
+            raise MessageError('No reply to get_tree')
+    if not isinstance(tree, type(u'')):
+        tree = codecs.utf_8_decode(tree)[0]
+    if fields is not None:
+        fields = set(fields)
+    try:
+        for node in __scan_tree__(tree, fields, prune):
+            yield node
+    except IndexError:
+        raise ValueError('Unexpected end of tree')
+
+
+def parse_tree(tree=None, fields=None, prune=None):
+    """
+    Same as "i3.iter_tree", but returns the whole tree (None if the root
+    node is pruned). The 'nodes' and 'floating_nodes' keys are always kept.
+    The reply is decoded at once with the JSON codec, then pruned and
+    stripped of the keys not in fields, so prune gets whole nodes. Example,
+    a tree of ids, names and windows only:
+      tree = i3.parse_tree(fields=['id', 'name', 'window'])
+    """
+    if tree is None:
+        tree = default_pool().get('get_tree')
+        if tree is None:
+            raise MessageError('No reply to get_tree')
     else:
-        for key, value in conditions.items():
-            if key not in tree or tree[key] != value:
-                break
+        if isinstance(tree, type(u'')):
+            tree = tree.encode('utf-8')  # codecs take bytes
+        tree = default_codec().loads(tree)
+    if fields is None and not prune:
+        return tree
+    if fields is not None:
+        fields = set(fields) | set(['nodes', 'floating_nodes'])
+    return __select_tree__(tree, fields, prune)
+
+
+def __select_tree__(tree, fields, prune):
+    """
+    Returns the given decoded tree without the nodes for which prune
+    returns True (and their subtrees), with nodes copied with only the
+    given fields. Nodes are kept as they are if fields is None. Returns
+    None if the root node is pruned.
+    """
+    if prune and prune(tree):
+        return None
+    def select(node):
+        if fields is None:
+            return node
+        return dict((name, node[name]) for name in fields if name in node)
+    root = select(tree)
+    nodes = [(tree, root)]
+    while nodes:
+        node, selected = nodes.pop()
+        for key in ('nodes', 'floating_nodes'):
+            children = node.get(key)
+            if children is None:
+                continue
+            kept = []
+            for child in children:
+                if prune and prune(child):
+                    continue
+                copy = select(child)
+                kept.append(copy)
+                nodes.append((child, copy))
+            selected[key] = kept
+    return root
+
+
+__json_decoder__ = json.JSONDecoder()
+__json_space__ = re.compile(r'[ \t\n\r]*')
+__json_string__ = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+# Everything up to and including the next bracket outside of strings, the
+# group matches opening brackets
+__json_bracket__ = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*'
+                              r'(?:([\[{])|[\]}])')
+__children_key__ = re.compile(r'"(?:nodes|floating_nodes)"[ \t\n\r]*:[ \t\n\r]*\[')
+
+
+def __scan_json__(text, end):
+    """
+    Decodes the JSON value at the given position, returns the value and
+    its end.
+    """
+    try:
+        return __json_decoder__.scan_once(text, end)
+    except StopIteration:
+        raise ValueError('Expecting a JSON value at %d' % end)
+
+
+def __skip_json__(text, end):
+    """
+    Returns the end of the JSON value at the given position. Strings,
+    objects and arrays are skipped without being decoded.
+    """
+    if text[end] == '"':
+        string = __json_string__.match(text, end)
+        if not string:
+            raise ValueError('Unterminated string at %d' % end)
+        return string.end()
+    if text[end] not in '[{':
+        return __scan_json__(text, end)[1]
+    depth = 0
+    match = __json_bracket__.match
+    while True:
+        bracket = match(text, end)
+        if not bracket:
+            raise ValueError('Unexpected end of JSON value')
+        end = bracket.end()
+        if bracket.lastindex:
+            depth += 1
+        else:
+            depth -= 1
+            if not depth:
+                return end
+
+
+def __scan_tree__(text, fields, prune):
+    """
+    Generator behind "i3.iter_tree". Without fields, keys before the
+    children of a node are decoded all at once by the JSON module's
+    scanner. Other keys are read one by one, values of keys not in fields
+    are skipped. Nodes whose children are being read are kept on a stack.
+    """
+    scan = __scan_json__
+    skip = __skip_json__
+    space = __json_space__.match
+    search = __children_key__.search
+    scanstring = json.decoder.scanstring
+    children_keys = ('nodes', 'floating_nodes')
+    stack = []  # (node, list of the children being read or None) tuples
+    end = space(text, 0).end()
+    new = True
+    while True:
+        if new:
+            if text[end] != '{':
+                raise ValueError('Expecting a node at %d' % end)
+            new = ready = pruned = False
+            node = None
+            match = fields is None and search(text, end)
+            if match:
+                head = text[end:match.start()].rstrip(' \t\n\r')
+                if head.endswith(','):
+                    head = head[:-1] + '}'
+                elif head == '{':
+                    head = '{}'
+                try:
+                    node, stop = scan(head, 0)
+                except ValueError:
+                    stop = None
+                if stop == len(head):
+                    end = match.start()
+                else:
+                    node = None  # the match belongs to another node
+            if node is None:
+                node = {}
+                end = space(text, end + 1).end()
+        if text[end] == '"':
+            key, end = scanstring(text, end + 1)
+            end = space(text, end).end()
+            if text[end] != ':':
+                raise ValueError('Expecting a colon at %d' % end)
+            end = space(text, end + 1).end()
+            children = key in children_keys and text[end] == '['
+            if children and not ready and not pruned:
+                ready = True
+                pruned = bool(prune and prune(node))
+                if not pruned:
+                    if stack and stack[-1][1] is not None:
+                        stack[-1][1].append(node)
+                    yield node
+            if pruned or (not children and fields is not None and
+                          key not in fields):
+                end = skip(text, end)
+            elif children:
+                children = None
+                if fields is None or key in fields:
+                    children = node[key] = []
+                end = space(text, end + 1).end()
+                if text[end] != ']':
+                    stack.append((node, children))
+                    new = True
+                    continue
+                end += 1
+            else:
+                node[key], end = scan(text, end)
+            end = __next_key__(text, end)
+            continue
+        if text[end] != '}':
+            raise ValueError('Expecting a key or the end of a node at %d' % end)
+        end += 1
+        if not ready and not (prune and prune(node)):
+            if stack and stack[-1][1] is not None:
+                stack[-1][1].append(node)
+            yield node
+        if not stack:
+            return
+        end = space(text, end).end()
+        if text[end] == ',':
+            end = space(text, end + 1).end()
+            new = True
+            continue
+        if text[end] != ']':
+            raise ValueError('Expecting a node or the end of a list at %d' % end)
+        node, children = stack.pop()
+        end = __next_key__(text, end + 1)
+        ready, pruned = True, False
+
+
+def __next_key__(text, end):
+    """
+    Returns the position of the next key of an object after a value ending
+    at the given position, or of the object's closing brace.
+    """
+    end = __json_space__.match(text, end).end()
+    if text[end] == ',':
+        end = __json_space__.match(text, end + 1).end()
+        if text[end] != '"':
+            raise ValueError('Expecting a key at %d' % end)
+    elif text[end] != '}':
+        raise ValueError('Expecting a comma or the end of a node at %d' % end)
+    return end
+
+
+def main(args=None):
+    """
+    Command-line entry point, "python -m i3". Either runs the daemon, or
+    sends a message (or a function to run) to it:
+      python -m i3 --daemon [--snapshot]
+      python -m i3 workspace 2
+      python -m i3 -t get_workspaces
+      python -m i3 --run myscripts:toggle scratchpad
+    For keybindings, "python -m i3client" does the same as a client faster,
+    as it doesn't import this module.
+    """
+    parser = argparse.ArgumentParser(prog='i3', description='i3-py daemon and client.')
+    parser.add_argument('--daemon', action='store_true', help="run the daemon")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="publish tree snapshots along with the daemon")
+    parser.add_argument('-s', metavar='<socket>', dest='path', default=None,
+                        help="path of the daemon's socket")
+    parser.add_argument('-t', metavar='<type>', dest='type', default='command',
+                        help="message type in text form (e.g. \"get_tree\")")
+    parser.add_argument('--run', metavar='<module:function>', default=None,
+                        help="function to run in the daemon, with message as args")
+    parser.add_argument('message', nargs='*', help="message to send")
+    args = parser.parse_args(args)
+    if args.daemon:
+        try:
+            daemon = Daemon(args.path)
+        except i3Exception as error:
+            print(error)
+            return 1
+        publisher = SnapshotPublisher() if args.snapshot else None
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            print('')  # force newline
+        finally:
+            daemon.close()
+            if publisher:
+                publisher.close()
+        return 0
+    try:
+        client = Client(args.path)
+        if args.run:
+            result = client.run(args.run, *args.message)
         else:
-            return [tree]
-    matches = []
-    for nodes in ['nodes', 'floating_nodes', 'list']:
-        if nodes in tree:
-            for node in tree[nodes]:
-                matches += filter(node, function, **conditions)
-    return matches
+            result = client.msg(args.type, ' '.join(args.message))
+    except i3Exception as error:
+        print(error)
+        return 1
+    print(json.dumps(result))
+    return 0
 
 
 class i3(ModuleType):
@@ -536,6 +4138,14 @@ class i3(ModuleType):
         self.__module__ = module
         self.__name__ = module.__name__
     
+    @property
+    def aio(self):
+        """
+        asyncio client (Python 3.5+), see the i3aio module.
+        """
+        import i3aio
+        return i3aio
+    
     def __getattr__(self, name):
         """
         Turns a nonexistent attribute into a function.
@@ -553,3 +4163,8 @@ class i3(ModuleType):
 
 # Turn the module into an i3 object
 sys.modules[__name__] = i3(sys.modules[__name__])
+
+if __name__ == '__main__':
+    # Run the importable module, so that scripts run by the daemon share its
+    # state (e.g. the tree cache) instead of getting a copy of their own
+    sys.exit(__import__('i3').main())
@@ -0,0 +1,205 @@
+#======================================================================
+# i3 (Python module for communicating with i3 window manager)
+# Copyright (C) 2012  Jure Ziberna
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#======================================================================
+"""
+asyncio client for the i3 window manager, available as "i3.aio". Needs
+Python 3.5 or newer. Example:
+  conn = await i3.aio.connect()
+  workspaces = await conn.get_workspaces()
+  await conn.focus('left')
+  conn.close()
+"""
+
+import asyncio
+import collections
+import struct
+import traceback
+
+import i3
+
+
+class Connection(object):
+    """
+    asyncio connection to i3-wm. Any number of coroutines can send requests
+    over it at the same time: requests are written in the order they're made
+    and a single reader task hands the replies out in the same order.
+    Besides "get", message types and commands are available as attributes,
+    the same way they are on the i3 module:
+      tree = await conn.get_tree()
+      await conn.focus(con_id=123)
+    Optional arguments:
+    - path of the i3 socket, "i3.get_socket_path()" if not given
+    - magic_string as a safety string for i3-ipc, 'i3-ipc' by default
+    - codec for JSON, see i3.Socket
+    """
+    magic_string = 'i3-ipc'
+    chunk_size = 64 * 1024  # in bytes
+
+    # Framing is shared with i3.Socket
+    encode = i3.Socket.encode
+    frame = i3.Socket.frame
+    decode = i3.Socket.decode
+
+    def __init__(self, path=None, magic_string=None, codec=None):
+        self.path = path
+        if magic_string:
+            self.magic_string = magic_string
+        self.codec = i3.get_codec(codec)
+        self.magic = self.magic_string.encode('utf-8')
+        self.header = struct.Struct('<%dsII' % len(self.magic))
+        self.buffer = i3.FrameBuffer(self.header)
+        self.pending = collections.deque()  # reply futures, oldest first
+        self.handlers = {}  # event type -> list of callbacks
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.drain_lock = None
+        self.closed = False
+
+    async def connect(self):
+        """
+        Connects to i3-wm and starts the reader task.
+        """
+        loop = asyncio.get_event_loop()
+        if not self.path:
+            self.path = await loop.run_in_executor(None, i3.get_socket_path)
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            raise i3.ConnectionError(self.path)
+        self.drain_lock = asyncio.Lock()
+        self.task = loop.create_task(self.listen())
+        return self
+
+    def __getattr__(self, name):
+        """
+        Turns a nonexistent attribute into a coroutine function, see
+        i3.__function__.
+        """
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name.lower() in i3.MSG_TYPES:
+            msg_type, message = name, ''
+        else:
+            msg_type, message = 'command', name
+        async def function(*args, **criteria):
+            msg_full = i3.__compose__(message, args, criteria)
+            response = i3.success(await self.get(msg_type, msg_full))
+            if isinstance(response, i3.i3Exception):
+                raise response
+            return response
+        function.__name__ = name
+        return function
+
+    async def get(self, msg_type, payload=''):
+        """
+        Sends the given message type and payload, returns the reply. Raises
+        i3.ConnectionError if the connection is closed or its reader task
+        is done.
+        """
+        if self.closed or not self.task or self.task.done():
+            raise i3.ConnectionError(self.path)
+        header, payload = self.frame(msg_type, payload)
+        future = asyncio.get_event_loop().create_future()
+        # Queued and written without yielding, so replies stay in order
+        self.pending.append(future)
+        self.writer.write(header)
+        self.writer.write(payload)
+        async with self.drain_lock:
+            await self.writer.drain()
+        return await future
+
+    async def command(self, *args, **criteria):
+        """
+        Sends a command made from the given args and container criteria.
+        Returns its success value, raises i3.MessageError on failure.
+        """
+        return await self.__getattr__('command')(*args, **criteria)
+
+    async def subscribe(self, event_type, callback):
+        """
+        Subscribes to the given event type. The callback is called with the
+        event and the connection, coroutine callbacks are run as tasks.
+        """
+        event_type = i3.parse_event_type(event_type)
+        self.handlers.setdefault(event_type, []).append(callback)
+        if len(self.handlers[event_type]) == 1:
+            return await self.get('subscribe', self.codec.dumps([event_type]))
+
+    async def listen(self):
+        """
+        Reads replies and events until the connection is closed.
+        """
+        error = i3.ConnectionError(self.path)
+        try:
+            while True:
+                data = await self.reader.read(self.chunk_size)
+                if not data:
+                    break
+                self.buffer.feed(data)
+                frame = self.buffer.next_frame()
+                while frame:
+                    msg_type, payload = frame
+                    self.route(msg_type, self.decode(payload))
+                    frame = self.buffer.next_frame()
+        except OSError as exception:
+            error = exception
+        finally:
+            # Nothing more is coming, fail whatever is still waiting
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+
+    def route(self, msg_type, data):
+        """
+        Passes a reply to the oldest waiting request, or an event to its
+        callbacks. Exceptions raised by callbacks are printed and don't
+        affect other callbacks.
+        """
+        event_type = i3.event_type_of(msg_type)
+        if not event_type:
+            if self.pending:
+                future = self.pending.popleft()
+                if not future.cancelled():
+                    future.set_result(data)
+            return
+        for callback in list(self.handlers.get(event_type, [])):
+            try:
+                result = callback(data, self)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if asyncio.iscoroutine(result):
+                asyncio.get_event_loop().create_task(result)
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.closed = True
+        if self.writer:
+            self.writer.close()
+        if self.task:
+            self.task.cancel()
+
+
+async def connect(path=None):
+    """
+    Returns a new connected i3.aio.Connection.
+    """
+    return await Connection(path).connect()
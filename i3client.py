@@ -0,0 +1,113 @@
+#======================================================================
+# i3 (Python module for communicating with i3 window manager)
+# Copyright (C) 2012  Jure Ziberna
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#======================================================================
+"""
+Minimal client of the i3-py daemon (see i3.Daemon), for keybindings. It
+doesn't import i3.py, so it starts about as fast as Python itself:
+  python -m i3client workspace 2
+  python -m i3client -t get_workspaces
+  python -m i3client --run myscripts:toggle scratchpad
+"""
+
+import os
+import sys
+import json
+import getopt
+import socket
+import struct
+
+
+MAGIC = b'i3-py'
+HEADER = struct.Struct('<%dsII' % len(MAGIC))
+
+
+class DaemonError(Exception):
+    """
+    Raised when the daemon reports an error.
+    """
+    pass
+
+
+def get_daemon_socket_path():
+    """
+    Returns the path of the daemon's socket, same as
+    "i3.get_daemon_socket_path()".
+    """
+    if os.environ.get('I3PY_SOCK'):
+        return os.environ['I3PY_SOCK']
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(os.environ.get('TMPDIR') or '/tmp',
+                                 'i3-py-%d' % os.getuid())
+    return os.path.join(directory, 'i3-py-%d.sock' % os.getuid())
+
+
+def receive(conn, size):
+    """
+    Receives exactly size bytes.
+    """
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise DaemonError('Connection closed by the daemon')
+        data += chunk
+    return data
+
+
+def request(payload, path=None, timeout=5):
+    """
+    Sends the given request (see i3.Daemon) and returns the result.
+    """
+    data = json.dumps(payload).encode('utf-8')
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path or get_daemon_socket_path())
+        conn.sendall(HEADER.pack(MAGIC, len(data), 0) + data)
+        magic, length, msg_type = HEADER.unpack(receive(conn, HEADER.size))
+        reply = json.loads(receive(conn, length).decode('utf-8'))
+    finally:
+        conn.close()
+    if 'error' in reply:
+        raise DaemonError(reply['error'])
+    return reply['result']
+
+
+def main(args=None):
+    """
+    Command-line entry point, see the module docs. Options:
+    -s <socket>, -t <message type> and --run <module:function>.
+    """
+    options, args = getopt.getopt(sys.argv[1:] if args is None else args,
+                                  's:t:', ['run='])
+    options = dict(options)
+    if '--run' in options:
+        payload = {'run': options['--run'], 'args': args}
+    else:
+        payload = {'type': options.get('-t', 'command'), 'message': ' '.join(args)}
+    try:
+        result = request(payload, options.get('-s'))
+    except (DaemonError, socket.error) as error:
+        print(error)
+        return 1
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,5 +16,5 @@ setup(
     url='https://github.com/ziberna/i3-py',
     version='0.6.5',
     license='GNU GPL 3',
-    py_modules=['i3']
+    py_modules=['i3', 'i3aio', 'i3client']
 )
@@ -1,7 +1,111 @@
 import i3
+import os
+import json
+import time
+import socket
+import select
+import struct
+import tempfile
+import threading
 import unittest
 import platform
 py3 = platform.python_version_tuple() > ('3',)
+socket_error = socket.error
+
+
+class Server(threading.Thread):
+    """
+    Stand-in for i3-wm on a temporary socket, for tests that shouldn't
+    depend on the running window manager. Records received messages as
+    (msg_type, payload) tuples and replies with "server.reply".
+    """
+    header = struct.Struct('<6sII')
+    event_types = ['workspace', 'output', 'mode', 'window', 'barconfig_update',
+                   'binding', 'shutdown', 'tick']
+    tree = {'id': 1, 'type': 'root', 'nodes': [
+        {'id': 2, 'type': 'workspace', 'name': '1', 'nodes': [
+            {'id': 3, 'name': 'a', 'window': 30, 'focused': True, 'nodes': []},
+            {'id': 4, 'name': 'b', 'window': 40, 'focused': False, 'nodes': []},
+        ], 'floating_nodes': [
+            {'id': 5, 'name': 'c', 'window': 50, 'focused': False, 'nodes': []},
+        ]},
+    ]}
+    
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = os.path.join(tempfile.mkdtemp(), 'ipc.sock')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(16)
+        self.messages = []
+        self.connections = []
+        self.subscribers = []
+        self.start()
+    
+    def reply(self, msg_type, payload):
+        if msg_type == 0:
+            return [{'success': True} for command in payload.split(';')]
+        if msg_type == 2:
+            return {'success': True}
+        if msg_type == 4:
+            return self.tree
+        return []
+    
+    def frame(self, msg_type, data):
+        data = json.dumps(data).encode('utf-8')
+        return self.header.pack(b'i3-ipc', len(data), msg_type) + data
+    
+    def event(self, event_type, data):
+        """Sends an event to every subscribed connection."""
+        index = self.event_types.index(event_type)
+        for conn in list(self.subscribers):
+            try:
+                conn.sendall(self.frame((1 << 31) | index, data))
+            except socket.error:
+                self.subscribers.remove(conn)  # closed by the client
+    
+    def drop(self):
+        """Closes every connection."""
+        for conn in self.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+        self.connections = []
+        self.subscribers = []
+    
+    def count(self, msg_type):
+        """Returns the number of received messages of the given type."""
+        return len([message for message in self.messages if message[0] == msg_type])
+    
+    def run(self):
+        while True:
+            conn, _ = self.server.accept()
+            self.connections.append(conn)
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    
+    def serve(self, conn):
+        data = b''
+        try:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                data += chunk
+                while len(data) >= self.header.size:
+                    magic, length, msg_type = self.header.unpack(data[:self.header.size])
+                    end = self.header.size + length
+                    if len(data) < end:
+                        break
+                    payload = data[self.header.size:end].decode('utf-8')
+                    data = data[end:]
+                    self.messages.append((msg_type, payload))
+                    if msg_type == 2 and conn not in self.subscribers:
+                        self.subscribers.append(conn)
+                    conn.sendall(self.frame(msg_type, self.reply(msg_type, payload)))
+        except socket.error:
+            pass
 
 class ParseTest(unittest.TestCase):
     def setUp(self):
@@ -40,6 +144,14 @@ class ParseTest(unittest.TestCase):
             self.assertRaises(i3.EventTypeError, i3.parse_event_type, val)
             self.assertRaises(i3.EventTypeError, i3.parse_event_type, str(val))
     
+    def test_modern_types(self):
+        self.assertEqual(i3.parse_msg_type('send_tick'), 10)
+        self.assertEqual(i3.parse_msg_type('GET_BINDING_STATE'), 12)
+        self.assertEqual(i3.parse_event_type('window'), 'window')
+        self.assertEqual(i3.parse_event_type(7), 'tick')
+        self.assertEqual(i3.event_type_of(i3.EVENT_FLAG | 3), 'window')
+        self.assertEqual(i3.event_type_of(4), None)
+    
     def test_msg_error(self):
         """If i3.yada doesn't pass, see http://bugs.i3wm.org/report/ticket/693"""
         self.assertRaises(i3.MessageError, i3.focus)  # missing argument
@@ -75,6 +187,1172 @@ class SocketTest(unittest.TestCase):
         packed = i3.default_socket().pack(0, "haha")
         if py3:
             self.assertIsInstance(packed, bytes)
+    
+    def test_pack_binary(self):
+        socket = i3.default_socket()
+        for payload in ['x' * 200, b'x' * 200, memoryview(b'x' * 200)]:
+            packed = socket.pack(0, payload)
+            self.assertEqual(socket.unpack_header(packed), (b'i3-ipc', 200, 0))
+            self.assertEqual(packed[socket.struct_header_size:], b'x' * 200)
+
+
+class ConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+    
+    def test_no_round_trip(self):
+        socket = i3.Socket(self.server.path)
+        self.assertTrue(socket.is_connected())
+        self.assertEqual(self.server.messages, [])
+        socket.close()
+        self.assertFalse(socket.connected)
+    
+    def test_lazy(self):
+        socket = i3.Socket('/nil/2971.socket', lazy=True)
+        self.assertEqual(socket.state, 'idle')
+        self.assertRaises(i3.ConnectionError, socket.get, 'get_marks')
+        socket = i3.Socket(self.server.path, lazy=True)
+        self.assertEqual(socket.get('get_marks'), [])
+        self.assertTrue(socket.is_connected())
+    
+    def test_shared_socket(self):
+        socket = i3.Socket(self.server.path)
+        socket.subscribe('window')
+        self.server.event('window', {'change': 'new'})
+        self.server.event('tick', {'first': False})
+        self.assertEqual(socket.get('get_tree'), Server.tree)
+        self.assertEqual(socket.get_many(['get_marks', 'get_marks']), [[], []])
+        self.assertEqual(socket.receive_message(), (i3.EVENT_FLAG | 3, {'change': 'new'}))
+        self.assertEqual(socket.poll(0), (i3.EVENT_FLAG | 7, {'first': False}))
+        self.assertEqual(socket.poll(0), None)
+        socket.close()
+    
+    def test_get_many(self):
+        socket = i3.Socket(self.server.path)
+        replies = socket.get_many(['get_tree', ('command', 'a; b'), ('get_marks', '')])
+        self.assertEqual(replies, [Server.tree, [{'success': True}] * 2, []])
+        self.assertEqual(self.server.messages, [(4, ''), (0, 'a; b'), (5, '')])
+        self.assertEqual(socket.get_many([]), [])
+    
+    def test_get_many_timeout(self):
+        class SlowServer(Server):
+            def reply(self, msg_type, payload):
+                if payload == 'slow':
+                    time.sleep(0.5)
+                return Server.reply(self, msg_type, payload)
+        server = SlowServer()
+        sock = i3.Socket(server.path, timeout=0.2, reconnect=True)
+        replies = sock.get_many(['get_marks', ('command', 'slow'), 'get_tree'])
+        self.assertEqual(replies, [[], None, None])
+        self.assertEqual(sock.state, 'disconnected')
+        self.assertEqual(sock.get('get_tree'), Server.tree)  # not the late reply
+        sock.close()
+    
+    def test_write_timeout(self):
+        path = os.path.join(tempfile.mkdtemp(), 'stalled.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(2)  # never read from
+        try:
+            stalled = i3.Socket(path, timeout=0.2)
+            self.assertRaises(socket_error, stalled.send, 'command', 'x' * (16 << 20))
+            self.assertEqual(stalled.state, 'disconnected')
+            shared = i3.MultiplexedSocket(path, timeout=0.2)
+            self.assertRaises(socket_error, shared.submit, 'command', 'x' * (16 << 20))
+            self.assertTrue(wait_until(lambda: not shared.is_connected()))
+            self.assertRaises(socket_error, shared.submit, 'get_marks')
+            shared.close()
+        finally:
+            listener.close()
+    
+    def test_reconnect(self):
+        sockets = [i3.Socket(self.server.path), i3.Socket(self.server.path, reconnect=True)]
+        for socket in sockets:
+            socket.get('get_marks')
+        self.server.drop()
+        for socket in sockets:
+            self.assertRaises(socket_error, socket.get, 'get_marks')
+            self.assertEqual(socket.state, 'disconnected')
+        self.assertRaises(socket_error, sockets[0].get, 'get_marks')
+        self.assertEqual(sockets[1].get('get_marks'), [])
+        self.assertEqual(sockets[1].state, 'connected')
+
+
+def wait_until(condition, timeout=2):
+    """Waits for a condition to become true, returns its last value."""
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class NonBlockingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.socket = i3.Socket(self.server.path, blocking=False)
+    
+    def tearDown(self):
+        self.socket.close()
+    
+    def test_read_available(self):
+        self.assertEqual(self.socket.read_available(), [])
+        self.assertEqual(self.socket.receive(), None)
+        self.socket.send('get_tree')
+        self.socket.send('get_marks')
+        self.assertEqual(self.socket.pending_writes, 0)
+        messages = []
+        while len(messages) < 2:
+            select.select([self.socket], [], [], 2)
+            messages += self.socket.read_available()
+        self.assertEqual(messages, [(4, Server.tree), (5, [])])
+        self.assertTrue(self.socket.connected)
+    
+    def test_feed(self):
+        data = self.server.frame(5, []) + self.server.frame(4, Server.tree)
+        self.assertEqual(self.socket.feed(data[:20]), [(5, [])])
+        self.assertEqual(self.socket.feed(data[20:]), [(4, Server.tree)])
+        self.assertEqual(self.socket.feed(), [])
+    
+    def test_pending_writes(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        path = os.path.join(tempfile.mkdtemp(), 'ipc.sock')
+        listener.bind(path)
+        listener.listen(1)
+        sock = i3.Socket(path, blocking=False)
+        payload = b'x' * (8 << 20)
+        sock.send('command', payload)  # nobody reads yet
+        self.assertTrue(0 < sock.pending_writes <= len(payload) + 14)
+        conn, _ = listener.accept()
+        received = []
+        reader = threading.Thread(target=lambda: received.append(
+            len(b''.join(iter(lambda: conn.recv(1 << 20), b'')))))
+        reader.start()
+        while not sock.flush():
+            select.select([], [sock], [], 2)
+        self.assertEqual(sock.pending_writes, 0)
+        sock.close()
+        reader.join()
+        self.assertEqual(received, [len(payload) + 14])
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.pool = i3.SocketPool(2, self.server.path)
+    
+    def tearDown(self):
+        self.pool.close()
+    
+    def test_threads(self):
+        results = []
+        def work():
+            for number in range(20):
+                results.append(self.pool.get('get_tree') == Server.tree)
+                results.append(self.pool.get_many(['get_marks', 'get_tree']) == [[], Server.tree])
+        threads = [threading.Thread(target=work) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 320)
+        self.assertEqual(self.pool.creations, 2)
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertEqual(self.pool.checkouts, 320)
+    
+    def test_health_check(self):
+        with self.pool.connection() as socket:
+            socket.send('get_marks')  # nobody reads the reply
+            select.select([socket.socket], [], [], 2)
+        self.assertEqual((self.pool.count, self.pool.discards), (0, 1))
+        self.assertEqual(socket.state, 'closed')
+        with self.pool.connection() as socket:
+            self.assertEqual(socket.get('get_marks'), [])
+        self.assertEqual(self.pool.idle, [socket])
+    
+    def test_checkout_timeout(self):
+        sockets = [self.pool.checkout(), self.pool.checkout()]
+        self.assertRaises(socket.timeout, self.pool.checkout, 0.05)
+        self.pool.checkin(sockets[0])
+        self.assertTrue(self.pool.checkout(0.05) is sockets[0])
+    
+    def test_affinity(self):
+        pool = i3.SocketPool(2, self.server.path, affinity=True)
+        sockets = [pool.checkout(), pool.checkout()]
+        pool.checkin(sockets[0])
+        checkin = threading.Thread(target=pool.checkin, args=(sockets[1],))
+        checkin.start()
+        checkin.join()
+        self.assertTrue(pool.checkout() is sockets[0])
+        pool.close()
+    
+    def test_default_socket(self):
+        module = i3.__module__
+        saved = (module.__socket__, module.__pool__)
+        try:
+            old = module.__pool__ = i3.SocketPool(2, self.server.path)
+            self.assertEqual(i3.get_marks(), [])
+            idle = old.idle[0]
+            i3.default_socket(i3.Socket(self.server.path))
+            self.assertTrue(old.closed)
+            self.assertEqual(idle.state, 'closed')
+            self.assertEqual(i3.get_marks(), [])
+            self.assertEqual(i3.default_pool().idle, [i3.default_socket()])
+        finally:
+            module.__socket__, module.__pool__ = saved
+
+
+class MultiplexedTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.shared = i3.MultiplexedSocket(self.server.path, timeout=2)
+    
+    def tearDown(self):
+        self.shared.close()
+    
+    def test_threads(self):
+        results = []
+        def work():
+            for number in range(20):
+                results.append(self.shared.get('get_tree') == Server.tree)
+                results.append(self.shared.get_many(['get_marks', 'command']) == [[], [{'success': True}]])
+        threads = [threading.Thread(target=work) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 320)
+        self.assertEqual(len(self.server.connections), 1)
+    
+    def test_events(self):
+        events = []
+        self.shared.add_handler(lambda event, data, dispatcher: events.append(event), 'window')
+        self.assertTrue(wait_until(lambda: self.server.subscribers))
+        futures = [self.shared.submit('get_marks'), self.shared.submit('get_tree')]
+        self.server.event('window', {'change': 'new'})
+        self.assertEqual([future.result(2) for future in futures], [[], Server.tree])
+        self.assertTrue(wait_until(lambda: events))
+        self.assertEqual(events, [{'change': 'new'}])
+    
+    def test_dropped(self):
+        self.assertEqual(self.shared.get('get_marks'), [])
+        self.server.drop()
+        self.assertTrue(wait_until(lambda: not self.shared.is_connected()))
+        self.assertRaises(socket_error, self.shared.get, 'get_marks')
+        self.shared.data_socket.get('get_marks')
+        self.shared.close()
+        self.assertEqual(self.shared.data_socket.state, 'closed')
+    
+    def test_data(self):
+        events = []
+        self.shared.add_handler(lambda event, data, dispatcher: events.append(data),
+                                'workspace', data=True)
+        self.assertTrue(wait_until(lambda: self.server.subscribers))
+        self.server.event('workspace', {'change': 'focus'})
+        self.assertTrue(wait_until(lambda: events))
+        self.assertEqual(events, [[]])
+        self.assertEqual(self.shared.get('get_marks'), [])
+    
+    def test_reader_failure(self):
+        def dispatch(event_type, event):
+            raise ValueError('broken handler')
+        self.shared.dispatcher.dispatch = dispatch
+        self.shared.add_handler(lambda event, data, dispatcher: None, 'window')
+        self.assertTrue(wait_until(lambda: self.server.subscribers))
+        future = self.shared.submit('get_marks')
+        self.assertEqual(future.result(2), [])
+        self.server.event('window', {'change': 'new'})
+        self.assertTrue(wait_until(lambda: not self.shared.is_connected()))
+        self.assertRaises(socket_error, self.shared.get, 'get_marks')
+
+
+class SocketPathTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.module = i3.__module__
+        self.saved = (os.environ.get('I3SOCK'), self.module.__socket_path__)
+        os.environ['I3SOCK'] = self.server.path
+        self.module.__socket_path__ = None
+    
+    def tearDown(self):
+        environ, self.module.__socket_path__ = self.saved
+        if environ is None:
+            del os.environ['I3SOCK']
+        else:
+            os.environ['I3SOCK'] = environ
+    
+    def test_environment(self):
+        self.assertEqual(i3.get_socket_path(), self.server.path)
+        os.environ['I3SOCK'] = '/nil/2971.socket'
+        self.assertEqual(i3.get_socket_path(), self.server.path)  # cached
+        self.assertEqual(i3.Socket().path, self.server.path)
+    
+    def test_invalidation(self):
+        os.environ['I3SOCK'] = '/nil/2971.socket'
+        socket = i3.Socket(lazy=True)
+        self.assertRaises(i3.ConnectionError, socket.get, 'get_marks')
+        self.assertIsNone(self.module.__socket_path__)
+        os.environ['I3SOCK'] = self.server.path
+        self.assertEqual(socket.get('get_marks'), [])
+        self.assertEqual(socket.path, self.server.path)
+
+
+class CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.default = i3.default_codec()
+    
+    def tearDown(self):
+        i3.default_codec(self.default)
+    
+    def test_codecs(self):
+        self.assertEqual(list(i3.CODECS)[-1], 'json')
+        data = json.dumps(Server.tree).encode('utf-8')
+        for codec in i3.CODECS.values():
+            self.assertEqual(codec.loads(data), Server.tree)
+            self.assertEqual(codec.loads(memoryview(data)), Server.tree)
+            payload = codec.dumps(['window'])
+            if not isinstance(payload, bytes):
+                payload = payload.encode('utf-8')
+            self.assertEqual(json.loads(payload.decode('utf-8')), ['window'])
+    
+    def test_socket(self):
+        decoded = []
+        def loads(data):
+            decoded.append(bytes(data))
+            return json.loads(bytes(data).decode('utf-8'))
+        codec = i3.Codec('recording', loads, json.dumps)
+        sock = i3.Socket(self.server.path, codec=codec)
+        self.assertEqual(sock.get('get_tree'), Server.tree)
+        self.assertEqual(len(decoded), 1)
+        sock.close()
+        self.assertIs(i3.Socket(self.server.path, lazy=True, codec='json').codec,
+                      i3.CODECS['json'])
+        self.assertRaises(i3.i3Exception, i3.Socket, self.server.path, codec='yaml')
+    
+    def test_default(self):
+        self.assertIs(i3.default_codec(), list(i3.CODECS.values())[0])
+        i3.default_codec('json')
+        self.assertIs(i3.Socket(self.server.path, lazy=True).codec, i3.CODECS['json'])
+
+
+class TreeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.socket = i3.Socket(self.server.path)
+        self.cache = i3.TreeCache(max_age=None, socket=self.socket,
+                                  event_socket=i3.Socket(self.server.path))
+        i3.tree_cache(self.cache)
+    
+    def tearDown(self):
+        self.cache.close()
+        self.assertIsNone(i3.tree_cache())
+    
+    def test_hits(self):
+        self.assertEqual(len(i3.filter(nodes=[])), 3)
+        self.assertEqual(i3.parent(3)['id'], 2)
+        self.assertEqual(i3.msg('get_tree')['id'], 1)
+        self.assertEqual(self.server.count(4), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+    
+    def test_events(self):
+        i3.msg('get_tree')
+        container = {'id': 4, 'name': 'renamed', 'nodes': []}
+        self.server.event('window', {'change': 'title', 'container': container})
+        self.assertTrue(wait_until(lambda: self.cache.patches == 1))
+        self.assertEqual(i3.filter(id=4)[0]['name'], 'renamed')
+        self.server.event('workspace', {'change': 'focus'})
+        self.assertTrue(wait_until(lambda: self.cache.invalidations == 1))
+        self.assertEqual(i3.filter(id=4)[0]['name'], 'b')
+        self.assertEqual(self.server.count(4), 2)
+    
+    def test_patch_while_fetching(self):
+        test = self
+        class Socket(object):
+            def get(self, msg_type):
+                tree = test.socket.get(msg_type)
+                container = {'id': 4, 'name': 'renamed', 'nodes': []}
+                test.cache.update({'change': 'title', 'container': container})
+                return tree
+        self.cache.socket = Socket()
+        self.assertEqual(self.cache.get()['id'], 1)
+        self.assertIsNone(self.cache.tree)  # fetched before the event
+        self.cache.socket = self.socket
+        self.cache.get()
+        self.assertEqual(self.server.count(4), 2)
+    
+    def test_compact(self):
+        cache = i3.TreeCache(max_age=None, socket=self.socket,
+                             event_socket=i3.Socket(self.server.path), compact=True)
+        self.assertIsInstance(cache.get(), i3.Node)
+        container = {'id': 4, 'name': 'renamed', 'nodes': []}
+        self.server.event('window', {'change': 'title', 'container': container})
+        self.assertTrue(wait_until(lambda: cache.patches == 1))
+        self.assertEqual(cache.index()[4]['name'], 'renamed')
+        cache.close()
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.dispatcher = i3.EventDispatcher(i3.Socket(self.server.path),
+                                             i3.Socket(self.server.path))
+        self.events = []
+    
+    def tearDown(self):
+        self.dispatcher.close()
+    
+    def handler(self, name):
+        def callback(event, data, dispatcher):
+            self.events.append((name, event['change'], data))
+        return callback
+    
+    def test_dispatch(self):
+        self.dispatcher.add_handler(self.handler('all'), 'workspace')
+        self.dispatcher.add_handler(self.handler('focus'), 'workspace', 'focus', data=True)
+        self.dispatcher.add_handler(self.handler('data'), 'workspace', data=True)
+        self.assertTrue(wait_until(lambda: len(self.server.subscribers) == 1))
+        self.server.event('workspace', {'change': 'focus'})
+        self.server.event('workspace', {'change': 'init'})
+        self.assertTrue(wait_until(lambda: len(self.events) == 5))
+        self.assertEqual(self.events, [('all', 'focus', None), ('focus', 'focus', []),
+                                       ('data', 'focus', []), ('all', 'init', None),
+                                       ('data', 'init', [])])
+        self.assertEqual(self.server.count(1), 2)  # one fetch per event
+        self.assertEqual(self.server.count(2), 1)
+    
+    def test_runtime_handlers(self):
+        handler = self.dispatcher.add_handler(self.handler('workspace'), 'workspace')
+        self.dispatcher.add_handler(self.handler('output'), 'output')
+        self.assertTrue(wait_until(lambda: self.server.count(2) == 2))
+        self.assertEqual(len(self.server.subscribers), 1)  # same connection
+        self.dispatcher.remove_handler(handler)
+        self.server.event('workspace', {'change': 'focus'})
+        self.server.event('output', {'change': 'unspecified'})
+        self.assertTrue(wait_until(lambda: len(self.events) == 1))
+        self.assertEqual(self.events, [('output', 'unspecified', None)])
+    
+    def test_default_data_socket(self):
+        dispatcher = i3.EventDispatcher(i3.Socket(self.server.path))
+        try:
+            dispatcher.add_handler(self.handler('data'), 'workspace', data=True)
+            self.assertTrue(wait_until(lambda: len(self.server.subscribers) == 1))
+            self.server.event('workspace', {'change': 'focus'})
+            self.assertTrue(wait_until(lambda: len(self.events) == 1))
+            self.assertEqual(self.events, [('data', 'focus', [])])
+        finally:
+            dispatcher.close()
+    
+    def test_data_failure(self):
+        self.dispatcher.data_socket = i3.Socket('/nonexistent/i3.sock', lazy=True)
+        self.dispatcher.add_handler(self.handler('data'), 'workspace', data=True)
+        self.assertTrue(wait_until(lambda: len(self.server.subscribers) == 1))
+        self.server.event('workspace', {'change': 'focus'})
+        self.server.event('workspace', {'change': 'init'})
+        self.assertTrue(wait_until(lambda: len(self.events) == 2))
+        self.assertEqual(self.events, [('data', 'focus', None), ('data', 'init', None)])
+        self.assertTrue(self.dispatcher.thread.is_alive())
+
+
+class ExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.gate = threading.Event()
+        self.calls = []
+    
+    def call(self, *args):
+        self.gate.wait(2)
+        self.calls.append(args)
+    
+    def fill(self, executor):
+        executor.submit(self.call, 'busy')
+        self.assertTrue(wait_until(lambda: executor.depth == 0))  # worker is busy
+        for number in range(4):
+            executor.submit(self.call, 'focus', number, key='focus')
+        executor.submit(self.call, 'init', key='init')
+    
+    def test_drop_oldest(self):
+        executor = i3.CallbackExecutor(maxsize=2, overflow='drop_oldest')
+        self.fill(executor)
+        self.assertEqual((executor.depth, executor.dropped), (2, 3))
+        self.gate.set()
+        executor.close()
+        self.assertEqual(self.calls, [('busy',), ('focus', 3), ('init',)])
+    
+    def test_coalesce(self):
+        executor = i3.CallbackExecutor(maxsize=2, overflow='coalesce')
+        self.fill(executor)
+        self.assertEqual((executor.depth, executor.coalesced), (2, 3))
+        self.gate.set()
+        executor.close()
+        self.assertEqual(self.calls, [('busy',), ('focus', 3), ('init',)])
+        self.assertEqual(executor.max_depth, 2)
+    
+    def test_block(self):
+        executor = i3.CallbackExecutor(workers=2, maxsize=1)
+        self.gate.set()
+        for number in range(10):
+            executor.submit(self.call, number)
+        executor.close()
+        self.assertEqual(sorted(self.calls), [(number,) for number in range(10)])
+        self.assertEqual(executor.dropped, 0)
+        self.assertRaises(RuntimeError, executor.submit, self.call)
+    
+    def test_subscription(self):
+        server = Server()
+        executor = i3.CallbackExecutor(overflow='coalesce')
+        started, events = [], []
+        def callback(event, data, subscription):
+            started.append(event)
+            self.gate.wait(2)
+            events.append((event['change'], data))
+        subscription = i3.Subscription(callback, 'workspace', executor=executor,
+                                       event_socket=i3.Socket(server.path),
+                                       data_socket=i3.Socket(server.path))
+        self.assertTrue(wait_until(lambda: server.subscribers))
+        server.event('workspace', {'change': 'init'})
+        self.assertTrue(wait_until(lambda: started))  # worker is busy
+        for number in range(3):
+            server.event('workspace', {'change': 'focus', 'number': number})
+        self.assertTrue(wait_until(lambda: executor.coalesced == 2))
+        self.gate.set()
+        self.assertTrue(wait_until(lambda: len(events) == 2))
+        subscription.close()
+        executor.close()
+        self.assertEqual(events, [('init', []), ('focus', [])])
+        self.assertEqual(started[-1]['number'], 2)
+
+
+class DebounceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.calls = []
+    
+    def subscribe(self, **options):
+        callback = lambda events, data, subscription: self.calls.append((events, data))
+        return i3.Subscription(callback, 'workspace', event_socket=i3.Socket(self.server.path),
+                               data_socket=i3.Socket(self.server.path), **options)
+    
+    def test_burst(self):
+        subscription = self.subscribe(debounce=0.1)
+        for number in range(5):
+            self.server.event('workspace', {'change': 'focus', 'number': number})
+        self.assertTrue(wait_until(lambda: self.calls))
+        subscription.close()
+        self.assertEqual(self.calls, [([{'change': 'focus', 'number': number}
+                                        for number in range(5)], [])])
+        self.assertEqual(self.server.count(1), 1)
+    
+    def test_max_latency(self):
+        subscription = self.subscribe(debounce=0.1, max_latency=0.2)
+        start = time.time()
+        while time.time() - start < 0.7:
+            self.server.event('workspace', {'change': 'focus'})
+            time.sleep(0.02)
+        self.assertTrue(len(self.calls) >= 2)
+        subscription.close()
+    
+    def test_event_filter(self):
+        subscription = self.subscribe(debounce=0.05, event='focus')
+        self.server.event('workspace', {'change': 'init'})
+        self.assertTrue(wait_until(lambda: self.calls))
+        self.server.event('workspace', {'change': 'init'})
+        self.server.event('workspace', {'change': 'focus'})
+        self.assertTrue(wait_until(lambda: len(self.calls) == 2))
+        subscription.close()
+        self.assertEqual([data for events, data in self.calls], [None, []])
+
+
+class EventStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+    
+    def events(self, *event_types, **options):
+        return i3.events(event_socket=i3.Socket(self.server.path), *event_types, **options)
+    
+    def test_iterate(self):
+        stream = self.events('workspace', 'output', timeout=2)
+        messages = [(msg_type, json.loads(payload))
+                    for msg_type, payload in self.server.messages]
+        self.assertEqual(messages, [(2, ['workspace', 'output'])])
+        self.server.event('workspace', {'change': 'focus'})
+        self.server.event('output', {'change': 'unspecified'})
+        received = []
+        for event_type, event in stream:
+            received.append((event_type, event['change']))
+            if len(received) == 2:
+                break
+        self.assertEqual(received, [('workspace', 'focus'), ('output', 'unspecified')])
+        self.assertEqual(stream.event_socket.state, 'closed')
+    
+    def test_timeout(self):
+        stream = self.events('workspace', timeout=0.2)
+        start = time.time()
+        self.assertEqual(list(stream), [])
+        self.assertTrue(0.2 <= time.time() - start < 0.5)
+        self.assertEqual(stream.event_socket.state, 'closed')
+    
+    def test_get(self):
+        with self.events('workspace') as stream:
+            self.assertEqual(stream.get(0), None)
+            self.server.event('workspace', {'change': 'init'})
+            self.assertEqual(stream.get(2), ('workspace', {'change': 'init'}))
+        self.assertEqual(stream.event_socket.state, 'closed')
+
+
+class WaitServer(Server):
+    def reply(self, msg_type, payload):
+        if msg_type == 0 and payload.startswith('exec '):
+            container = {'id': 7, 'window_properties': {'class': payload[5:]}}
+            threading.Timer(0.05, self.event, ['window', {'change': 'new',
+                                                          'container': container}]).start()
+        if msg_type == 0 and payload == 'workspace 2':
+            self.event('workspace', {'change': 'focus', 'current': {'name': '2'}})
+        if msg_type == 10:
+            self.event('tick', {'first': False, 'payload': payload})
+            return {'success': True}
+        return Server.reply(self, msg_type, payload)
+
+
+class WaitTest(unittest.TestCase):
+    def setUp(self):
+        self.server = WaitServer()
+        self.socket = i3.Socket(self.server.path)
+    
+    def command(self, message):
+        return lambda: self.socket.get('command', message)
+    
+    def test_wait_for(self):
+        focused = lambda event: event['change'] == 'focus'
+        event = i3.wait_for('workspace', focused, 2, self.command('workspace 2'),
+                            event_socket=i3.Socket(self.server.path))
+        self.assertEqual(event['current'], {'name': '2'})
+        start = time.time()
+        event = i3.wait_for('workspace', focused, 2, self.command('workspace 1'),
+                            settle=True, event_socket=i3.Socket(self.server.path))
+        self.assertEqual(event, None)
+        self.assertTrue(time.time() - start < 1)
+    
+    def test_barrier(self):
+        with i3.EventStream(['workspace'], event_socket=i3.Socket(self.server.path)) as stream:
+            self.socket.get('command', 'workspace 2')
+            events = stream.barrier(2)
+            self.assertEqual([event['change'] for event_type, event in events], ['focus'])
+            self.assertEqual(stream.get(0), None)  # ticks aren't passed on
+    
+    def test_exec_and_wait(self):
+        start = time.time()
+        container = i3.exec_and_wait('urxvt', {'class': 'urxvt'},
+                                     event_socket=i3.Socket(self.server.path))
+        self.assertEqual(container['id'], 7)
+        self.assertTrue(time.time() - start < 1)
+        container = i3.exec_and_wait('xterm', {'class': 'urxvt'}, timeout=0.2,
+                                     event_socket=i3.Socket(self.server.path))
+        self.assertEqual(container, None)
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            import asyncio
+        except ImportError:
+            self.skipTest('asyncio is not available')
+        self.server = Server()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.asyncio = asyncio
+        self.conn = self.complete(i3.aio.connect(self.server.path))
+    
+    def tearDown(self):
+        self.conn.close()
+        self.loop.close()
+        self.asyncio.set_event_loop(None)
+    
+    def complete(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+    
+    def test_concurrent(self):
+        replies = self.complete(self.asyncio.gather(
+            self.conn.get('get_tree'), self.conn.get_marks(),
+            self.conn.focus('left', con_id=3), self.conn.command('layout', 'tabbed')))
+        self.assertEqual(replies, [Server.tree, [], [True], [True]])
+        self.assertEqual(self.server.messages[2:], [
+            (0, '[con_id="3"] focus left'), (0, ' layout tabbed')])
+    
+    def test_events(self):
+        events = []
+        self.complete(self.conn.subscribe('workspace', lambda event, conn: events.append(event)))
+        self.server.event('workspace', {'change': 'focus'})
+        self.assertEqual(self.complete(self.conn.get_marks()), [])
+        self.assertEqual(events, [{'change': 'focus'}])
+    
+    def test_failing_callback(self):
+        events = []
+        def fail(event, conn):
+            raise ValueError('broken callback')
+        self.complete(self.conn.subscribe('workspace', fail))
+        self.complete(self.conn.subscribe('workspace', lambda event, conn: events.append(event)))
+        self.server.event('workspace', {'change': 'focus'})
+        self.assertEqual(self.complete(self.conn.get_marks()), [])
+        self.assertEqual(events, [{'change': 'focus'}])
+    
+    def test_dropped(self):
+        self.assertTrue(wait_until(lambda: self.server.connections))
+        self.server.drop()
+        self.complete(self.asyncio.wait_for(self.conn.task, 2))
+        self.assertRaises(i3.ConnectionError, self.complete, self.conn.get_marks())
+    
+    def test_closed(self):
+        self.conn.close()
+        self.assertRaises(i3.ConnectionError, self.complete, self.conn.get_marks())
+
+
+class WorkspaceServer(Server):
+    outputs = [
+        {'name': 'A', 'active': True, 'current_workspace': '1',
+         'rect': {'x': 0, 'y': 0, 'width': 100, 'height': 100}},
+        {'name': 'B', 'active': True, 'current_workspace': '2',
+         'rect': {'x': 100, 'y': 0, 'width': 100, 'height': 100}},
+    ]
+    workspaces = [
+        {'id': 11, 'num': 1, 'name': '1', 'output': 'A', 'visible': True,
+         'focused': True, 'urgent': False},
+        {'id': 13, 'num': 3, 'name': '3', 'output': 'A', 'visible': False,
+         'focused': False, 'urgent': False},
+        {'id': 12, 'num': 2, 'name': '2', 'output': 'B', 'visible': True,
+         'focused': False, 'urgent': False},
+    ]
+    
+    def reply(self, msg_type, payload):
+        if msg_type == 1:
+            return self.workspaces
+        if msg_type == 3:
+            return self.outputs
+        return Server.reply(self, msg_type, payload)
+
+
+class WorkspaceStateTest(unittest.TestCase):
+    def setUp(self):
+        self.server = WorkspaceServer()
+        self.changes = []
+        self.state = i3.WorkspaceState(i3.Socket(self.server.path), i3.Socket(self.server.path),
+                                       callback=self.changes.append)
+    
+    def tearDown(self):
+        self.state.close()
+    
+    def event(self, change, **current):
+        events = self.state.events
+        self.server.event('workspace', {'change': change, 'current': current})
+        self.assertTrue(wait_until(lambda: self.state.events == events + 1))
+    
+    def names(self, key):
+        return [workspace['name'] for workspace in self.state.get_workspaces()
+                if workspace[key]]
+    
+    def test_bootstrap(self):
+        self.assertEqual(self.state.get_workspaces(), WorkspaceServer.workspaces)
+        self.assertEqual(self.state.get_outputs(), WorkspaceServer.outputs)
+        self.assertEqual(self.state.focused()['name'], '1')
+        self.assertEqual((self.server.count(1), self.server.count(3)), (1, 1))
+    
+    def test_apply(self):
+        self.event('focus', id=13, name='3')
+        self.assertEqual((self.names('focused'), self.names('visible')), (['3'], ['3', '2']))
+        self.assertEqual(self.state.get_outputs()[0]['current_workspace'], '3')
+        self.event('init', id=14, num=4, name='4', rect={'x': 100, 'y': 20, 'width': 100, 'height': 80})
+        self.event('focus', id=14, name='4')
+        self.assertEqual(self.state.workspace('4')['output'], 'B')
+        self.assertEqual(self.names('visible'), ['3', '4'])
+        self.event('empty', id=12, name='2')
+        self.event('urgent', id=11, name='1', urgent=True)
+        self.event('rename', id=14, num=-1, name='www')
+        self.assertEqual([(workspace['name'], workspace['output']) for workspace in
+                          self.state.get_workspaces()], [('1', 'A'), ('3', 'A'), ('www', 'B')])
+        self.assertEqual(self.names('urgent'), ['1'])
+        self.assertEqual(self.state.get_outputs()[1]['current_workspace'], 'www')
+        self.assertEqual((self.state.applied, self.state.resyncs), (6, 1))
+        self.assertEqual(len(self.changes), 6)
+        self.assertEqual((self.server.count(1), self.server.count(3)), (1, 1))
+    
+    def test_resync(self):
+        snapshot = self.state.snapshot
+        self.event('focus', id=99, name='unknown')
+        self.event('move', id=11, name='1', rect={'x': 150, 'y': 0, 'width': 50, 'height': 100})
+        events = self.state.events
+        self.server.event('output', {'change': 'unspecified'})
+        self.assertTrue(wait_until(lambda: self.state.events == events + 1))
+        self.assertEqual(self.state.resyncs, 4)
+        self.assertEqual((self.server.count(1), self.server.count(3)), (4, 4))
+        self.assertEqual(self.state.snapshot, snapshot)
+        self.assertFalse(self.state.snapshot is snapshot)
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.path = os.path.join(tempfile.mkdtemp(), 'i3-py.sock')
+        self.daemon = i3.Daemon(self.path, i3.Socket(self.server.path),
+                                i3.Socket(self.server.path))
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        self.client = i3.Client(self.path)
+    
+    def tearDown(self):
+        self.client.close()
+        self.daemon.close()
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(i3.tree_cache(), None)
+    
+    def test_msg(self):
+        self.assertEqual(self.client.msg('get_tree'), Server.tree)
+        self.assertEqual(self.client.msg('get_tree'), Server.tree)
+        self.assertEqual(self.server.count(4), 1)  # cached
+        self.assertEqual(self.client.msg('command', 'focus left'), [{'success': True}])
+        self.assertEqual(self.server.messages[-1], (0, 'focus left'))
+    
+    def test_run(self):
+        self.assertEqual(self.client.run('json:dumps', [1, 2]), '[1, 2]')
+        self.assertEqual(self.client.run('i3:parent', 3)['id'], 2)  # from the cache
+        self.assertEqual(self.server.count(4), 1)
+        self.assertRaises(i3.MessageError, self.client.run, 'os:nonexistent')
+        self.assertRaises(i3.MessageError, self.client.msg, 'nonexistent')
+        self.assertRaises(i3.MessageError, self.client.run, 'threading:Lock')  # not JSON
+        self.assertEqual(self.client.run('os.path:join', 'a', 'b'), 'a/b')
+    
+    def test_bind(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o077, 0)
+        self.assertRaises(i3.i3Exception, i3.Daemon, self.path,
+                          i3.Socket(self.server.path), i3.Socket(self.server.path))
+        self.assertEqual(self.client.msg('get_marks'), [])  # still served
+        stale = os.path.join(os.path.dirname(self.path), 'stale.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(stale)
+        listener.close()  # left behind
+        daemon = i3.Daemon(stale, i3.Socket(self.server.path), i3.Socket(self.server.path))
+        daemon.close()
+    
+    def test_thin_client(self):
+        import i3client
+        self.assertEqual(i3client.request({'type': 'get_marks'}, self.path), [])
+        self.assertEqual(i3client.request({'run': 'os.path:join', 'args': ['a', 'b']},
+                                          self.path), 'a/b')
+        self.assertRaises(i3client.DaemonError, i3client.request,
+                          {'type': 'nonexistent'}, self.path)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.path = os.path.join(tempfile.mkdtemp(), 'i3-py.tree')
+        self.publisher = i3.SnapshotPublisher(self.path, i3.Socket(self.server.path),
+                                              i3.Socket(self.server.path))
+        self.reader = i3.SnapshotReader(self.path)
+        self.assertTrue(wait_until(lambda: self.reader.sequence == 2))
+    
+    def tearDown(self):
+        self.reader.close()
+        self.publisher.close()
+    
+    def test_read(self):
+        tree = self.reader.tree()
+        self.assertEqual(tree.to_dict(), Server.tree)
+        self.assertEqual(tree['nodes'][0]['floating_nodes'][0]['name'], 'c')
+        self.assertIs(tree['nodes'][0]['nodes'][1].parent(), tree['nodes'][0])
+        self.assertNotIn('window', tree)
+        self.assertEqual([node['id'] for node in i3.filter(tree, nodes=[])], [3, 4, 5])
+        self.assertEqual(i3.Tree(tree).workspace_of(5)['name'], '1')
+        self.assertTrue(self.reader.fresh())
+        self.assertIs(self.reader.tree(), tree)
+    
+    def test_updates(self):
+        self.server.event('window', {'change': 'focus'})
+        self.server.event('window', {'change': 'title'})
+        self.assertTrue(wait_until(lambda: self.reader.sequence == 4))
+        self.assertEqual(self.server.count(4), 2)  # one update for the burst
+        self.assertFalse(self.reader.fresh())
+        tree = json.loads(json.dumps(Server.tree))
+        tree['nodes'][0].update(name=None, marks=['m'], rect={'x': 1, 'y': 2,
+                                                          'width': 3, 'height': 4})
+        tree['nodes'][0]['nodes'][0]['name'] = u'\u00e9' * 100000  # grows the file
+        self.publisher.publish(tree)
+        self.assertEqual(self.reader.tree().to_dict(), tree)
+        self.assertEqual(self.reader.sequence, 6)
+    
+    def test_restart(self):
+        self.publisher.close()
+        self.publisher = i3.SnapshotPublisher(self.path, i3.Socket(self.server.path),
+                                              i3.Socket(self.server.path))
+        self.assertTrue(wait_until(lambda: self.reader.sequence == 4))
+        self.assertEqual(self.reader.tree()['id'], 1)
+    
+    def test_private_paths(self):
+        link = os.path.join(os.path.dirname(self.path), 'link.tree')
+        os.symlink(self.path, link)
+        self.assertRaises(OSError, i3.SnapshotPublisher, link)
+        environ = dict(os.environ)
+        try:
+            for name in ('XDG_RUNTIME_DIR', 'I3PY_SNAPSHOT', 'I3PY_SOCK'):
+                os.environ.pop(name, None)
+            os.environ['TMPDIR'] = tempfile.mkdtemp()
+            directory = os.path.join(os.environ['TMPDIR'], 'i3-py-%d' % os.getuid())
+            self.assertEqual(os.path.dirname(i3.get_snapshot_path()), directory)
+            self.assertEqual(os.path.dirname(i3.get_daemon_socket_path()), directory)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+            os.chmod(directory, 0o755)
+            self.assertRaises(OSError, i3.get_snapshot_path)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+
+class TreeTest(unittest.TestCase):
+    def setUp(self):
+        tree = json.loads(json.dumps(Server.tree))
+        tree['nodes'][0]['nodes'][1]['marks'] = ['m']
+        self.tree = i3.Tree(tree)
+    
+    def test_lookup(self):
+        self.assertEqual(len(self.tree), 5)
+        self.assertEqual(self.tree[3]['name'], 'a')
+        self.assertEqual(self.tree.window(50)['id'], 5)
+        self.assertEqual(self.tree.mark('m')['id'], 4)
+        self.assertEqual(self.tree.workspace('1')['id'], 2)
+        self.assertIsNone(self.tree.get(100))
+    
+    def test_parents(self):
+        self.assertEqual(self.tree.parent(5)['id'], 2)
+        self.assertIsNone(self.tree.parent(1))
+        self.assertEqual(i3.parent(3, self.tree)['id'], 2)
+        self.assertEqual(i3.parent(4, self.tree.root)['id'], 2)
+        self.assertEqual([node['id'] for node in self.tree.ancestors(4)], [2, 1])
+        self.assertEqual(self.tree.workspace_of(5)['id'], 2)
+        self.assertIsNone(self.tree.workspace_of(1))
+    
+    def test_descendants(self):
+        self.assertEqual([node['id'] for node in self.tree], [1, 2, 3, 4, 5])
+        self.assertEqual([node['id'] for node in self.tree.descendants(2)], [3, 4, 5])
+        self.assertEqual(self.tree.filter(nodes=[], focused=False),
+                         i3.filter(self.tree, nodes=[], focused=False))
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = json.loads(json.dumps(Server.tree))
+    
+    def ids(self, nodes):
+        return [node['id'] for node in nodes]
+    
+    def test_query(self):
+        query = i3.Query(nodes=[], focused=False)
+        self.assertEqual(self.ids(query.all(self.tree)), [4, 5])
+        self.assertEqual(self.ids(query.all(self.tree, limit=1)), [4])
+        self.assertEqual(query.first(self.tree)['id'], 4)
+        self.assertIsNone(i3.Query(name='z').first(self.tree))
+        query = i3.Query(nodes=[], children=['nodes'])
+        self.assertEqual(self.ids(query.all(self.tree)), [3, 4])
+    
+    def test_early_exit(self):
+        visited = []
+        def function(node):
+            visited.append(node['id'])
+            return 'window' in node
+        self.assertEqual(i3.Query(function).first(self.tree)['id'], 3)
+        self.assertEqual(visited, [1, 2, 3])
+    
+    def test_filter(self):
+        self.assertEqual(self.ids(i3.filter(self.tree, focused=False)), [4, 5])
+        self.assertEqual(self.ids(i3.filter(self.tree, type='workspace')), [2])
+        self.assertEqual(self.ids(i3.filter(self.tree, lambda node: node['window'] > 30)), [4, 5])
+        self.assertEqual(self.ids(i3.filter(self.tree['nodes'], nodes=[])), [3, 4, 5])
+        self.assertEqual(self.ids(i3.iter_filter(self.tree, nodes=[])), [3, 4, 5])
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = json.loads(json.dumps(Server.tree))
+        self.tree['nodes'][0].update(rect={'x': 0, 'y': 0, 'width': 10, 'height': 10},
+                                     focus=[3, 4, 5])
+        self.data = json.dumps(self.tree).encode('utf-8')
+    
+    def ids(self, nodes):
+        return [node['id'] for node in nodes]
+    
+    def test_parse(self):
+        self.assertEqual(i3.parse_tree(self.data), self.tree)
+        self.assertEqual(i3.parse_tree(json.dumps(self.tree, indent=2)), self.tree)
+        tree = i3.parse_tree(self.data, fields=['id', 'focused'])
+        self.assertEqual(tree['nodes'][0], {'id': 2, 'nodes': [
+            {'id': 3, 'focused': True, 'nodes': []},
+            {'id': 4, 'focused': False, 'nodes': []}], 'floating_nodes': [
+            {'id': 5, 'focused': False, 'nodes': []}]})
+        self.assertEqual(i3.filter(tree, focused=True)[0]['id'], 3)
+        self.assertRaises(ValueError, i3.parse_tree, self.data[:-20])
+        self.assertRaises(ValueError, i3.parse_tree, b'{"id": 1 "nodes": []}')
+    
+    def test_codecs(self):
+        default = i3.default_codec()
+        try:
+            for codec in i3.CODECS.values():
+                i3.default_codec(codec)
+                self.test_parse()
+                self.test_prune()
+        finally:
+            i3.default_codec(default)
+    
+    def test_iter(self):
+        self.assertEqual(self.ids(i3.iter_tree(self.data)), [1, 2, 3, 4, 5])
+        nodes = i3.iter_tree(self.data, fields=['id', 'focused'])
+        self.assertEqual(next(node for node in nodes if node.get('focused'))['id'], 3)
+        self.assertEqual(list(nodes)[-1], {'id': 5, 'focused': False})
+    
+    def test_prune(self):
+        prune = lambda node: node.get('name') == 'b' or node.get('window') == 50
+        tree = i3.parse_tree(self.data, prune=prune)
+        self.assertEqual(self.ids(tree['nodes'][0]['nodes']), [3])
+        self.assertEqual(tree['nodes'][0]['floating_nodes'], [])
+        self.assertEqual(self.ids(i3.iter_tree(self.data, prune=prune)), [1, 2, 3])
+        self.assertIsNone(i3.parse_tree(self.data, prune=lambda node: True))
+        tree = i3.parse_tree(self.data, prune=lambda node: node.get('focus') == [3, 4, 5])
+        self.assertEqual(tree['nodes'], [])  # whole nodes, keys after the children too
+    
+    def test_skip(self):
+        data = b'{"id": 1, "name": "invalid \\q escape", "nodes": [{"id": 2}]}'
+        self.assertRaises(ValueError, i3.parse_tree, data)
+        self.assertEqual(list(i3.iter_tree(data, fields=['id'])), [{'id': 1}, {'id': 2}])
+        seen = []
+        prune = lambda node: seen.append(sorted(node)) or node['id'] == 2
+        self.assertEqual(self.ids(i3.iter_tree(self.data, fields=['id'], prune=prune)), [1])
+        self.assertEqual(seen, [['id'], ['id']])
+    
+    def test_fetch(self):
+        server = Server()
+        sock = i3.Socket(server.path)
+        self.assertEqual(json.loads(sock.get_raw('get_tree').decode('utf-8')), Server.tree)
+        sock.close()
+        pool = i3.SocketPool(1, server.path)
+        self.assertEqual(json.loads(pool.get_raw('get_tree').decode('utf-8')), Server.tree)
+        self.assertEqual(pool.idle[0].get('get_marks'), [])
+        pool.close()
+
+
+class NodeTest(unittest.TestCase):
+    def setUp(self):
+        self.data = json.loads(json.dumps(Server.tree))
+        self.data['nodes'][0].update(rect={'x': 0, 'y': 0, 'width': 10, 'height': 20},
+                                     layout='splith', marks=['m'], extra_key=1)
+        self.data['nodes'][0]['nodes'][1]['window_properties'] = {'class': 'URxvt'}
+        self.tree = i3.Node(self.data)
+    
+    def test_access(self):
+        workspace = self.tree['nodes'][0]
+        self.assertIsInstance(workspace, i3.Node)
+        self.assertEqual(workspace['name'], '1')
+        self.assertEqual(workspace['extra_key'], 1)
+        self.assertIn('marks', workspace)
+        self.assertNotIn('window', workspace)
+        self.assertRaises(KeyError, lambda: workspace['window'])
+        self.assertIsNone(workspace.get('window'))
+        self.assertEqual(workspace['rect'], (0, 0, 10, 20))
+        self.assertEqual(workspace['rect']['height'], 20)
+        self.assertEqual(workspace['rect'], {'x': 0, 'y': 0, 'width': 10, 'height': 20})
+        self.assertEqual(self.tree.to_dict(), self.data)
+    
+    def test_shared_strings(self):
+        other = i3.Node(json.loads(json.dumps(self.data)))
+        self.assertIs(other['nodes'][0]['layout'], self.tree['nodes'][0]['layout'])
+        self.assertIs(other['nodes'][0]['nodes'][1]['window_properties']['class'],
+                      self.tree['nodes'][0]['nodes'][1]['window_properties']['class'])
+    
+    def test_queries(self):
+        self.assertEqual([node['id'] for node in i3.filter(self.tree, nodes=[])], [3, 4, 5])
+        self.assertEqual(i3.filter(self.tree, lambda node: node['window'] > 40)[0]['id'], 5)
+        self.assertEqual(i3.Tree(self.tree).mark('m')['id'], 2)
+        self.assertEqual(i3.parent(4, self.tree)['id'], 2)
+
+
+class BatchServer(Server):
+    """Fails commands containing 'fail', stops at the ones with 'nope'."""
+    def reply(self, msg_type, payload):
+        if msg_type != 0:
+            return Server.reply(self, msg_type, payload)
+        response = []
+        for command in payload.split(';'):
+            if 'nope' in command:
+                response.append({'success': False, 'parse_error': True, 'error': 'nope'})
+                break
+            elif 'fail' in command:
+                response.append({'success': False, 'error': 'fail'})
+            else:
+                response.append({'success': True})
+        return response
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = BatchServer()
+        self.socket = i3.Socket(self.server.path)
+    
+    def test_batch(self):
+        with i3.batch(self.socket) as batch:
+            self.assertEqual(batch.focus('left'), 0)
+            self.assertEqual(batch.move('scratchpad', con_id=12), 1)
+            batch.add('layout', 'tabbed')
+        self.assertEqual(batch.results, [True, True, True])
+        self.assertEqual(self.server.messages, [
+            (0, 'focus left; [con_id="12"] move scratchpad; layout tabbed')])
+    
+    def test_errors(self):
+        batch = i3.Batch(self.socket)
+        for command in ['a', 'fail', 'nope', 'b']:
+            batch.add(command)
+        results = batch.send()
+        self.assertEqual(results[0], True)
+        self.assertIsInstance(results[1], i3.MessageError)
+        self.assertIsInstance(results[2], i3.MessageError)
+        self.assertEqual(results[3], True)
+        self.assertEqual([command for command, error in batch.errors], ['fail', 'nope'])
+        self.assertEqual(self.server.count(0), 2)
+    
+    def test_split(self):
+        batch = i3.Batch(self.socket, max_payload=30)
+        for number in range(5):
+            batch.workspace(str(number))
+        self.assertEqual(batch.send(), [True] * 5)
+        self.assertEqual(self.server.count(0), 3)
+
+
+class FrameBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.header = struct.Struct('<6sII')
+        self.buffer = i3.FrameBuffer(self.header, size=16)
+    
+    def frame(self, msg_type, data):
+        payload = json.dumps(data).encode('utf-8')
+        return self.header.pack(b'i3-ipc', len(payload), msg_type) + payload
+    
+    def frames(self):
+        frames = []
+        frame = self.buffer.next_frame()
+        while frame:
+            msg_type, payload = frame
+            frames.append((msg_type, json.loads(payload.tobytes().decode('utf-8'))))
+            frame = self.buffer.next_frame()
+        return frames
+    
+    def test_several_frames(self):
+        data = self.frame(1, [1, 2]) + self.frame(4, {'id': 3})
+        self.buffer.feed(data)
+        self.assertEqual(self.frames(), [(1, [1, 2]), (4, {'id': 3})])
+        self.assertEqual(len(self.buffer), 0)
+    
+    def test_split_frames(self):
+        data = self.frame(0, {'success': True}) + self.frame(4, {'name': 'x' * 100})
+        frames = []
+        for index in range(len(data)):
+            self.buffer.feed(data[index:index+1])
+            frames += self.frames()
+        self.assertEqual(frames, [(0, {'success': True}), (4, {'name': 'x' * 100})])
+        self.assertEqual(self.buffer.missing(), self.header.size)
 
 
 class GeneralTest(unittest.TestCase):
@@ -127,7 +1405,12 @@ class GeneralTest(unittest.TestCase):
 
 if __name__ == '__main__':
     test_suits = []
-    for Test in [ParseTest, SocketTest, GeneralTest]:
+    for Test in [ParseTest, SocketTest, ConnectionTest, NonBlockingTest,
+                 PoolTest, MultiplexedTest, SocketPathTest, CodecTest,
+                 TreeCacheTest, DispatcherTest, ExecutorTest, DebounceTest,
+                 EventStreamTest, WaitTest, AsyncTest, WorkspaceStateTest,
+                 DaemonTest, SnapshotTest, TreeTest, QueryTest, StreamTest,
+                 NodeTest, BatchTest, FrameBufferTest, GeneralTest]:
         test_suits.append(unittest.TestLoader().loadTestsFromTestCase(Test))
     unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(test_suits))
 